@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import build
+
+# Benchmarks for build.py
+#
+# Each scale generates a synthetic site (publications, news, auto links and
+# notes, and a long profile) in a temporary directory, builds it end to end,
+# and then times the individual builders on the same data. Times are the
+# best of a few runs. The exponent column is the slope of log(time) against
+# log(scale): about 1 is linear, about 2 means something turned quadratic.
+#
+# Startup is timed separately, in fresh processes: --help and an incremental
+# build with nothing to do should not import any of the slow modules below,
+# and should take at most --startup-budget longer than a bare interpreter.
+# Last, the weight of each page (its bytes plus the stylesheets and scripts it
+# loads, and how many requests that takes) is compared across build options.
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "bench_baseline.json")
+
+FIRST = ["Ada", "Alan", "Barbara", "Carlos", "Daniela", "Edsger", "Frances", "Grace", "Hedy", "Ivan",
+         "Jean", "Karla", "Leslie", "María", "Niklaus", "Olga", "Pedro", "Radia", "Sofía", "Tony"]
+LAST = ["Allen", "Backus", "Chávez", "Dijkstra", "Estrin", "Floyd", "Goldberg", "Hopper", "Iverson", "Jones",
+        "Knuth", "Liskov", "Milner", "Naur", "Ostrom", "Perlman", "Rocha", "Sutherland", "Thompson", "Wirth"]
+WORDS = ["scalable", "verification", "of", "neural", "systems", "for", "portable", "microscopy", "with",
+         "string", "solvers", "and", "fast", "diagnosis", "in", "the", "field", "using", "learned", "models"]
+KEYWORDS = ["Publications", "Workshops", "Preprints"]
+MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+OWNER = "Benchmark Owner"
+SLOW_MODULES = ["pybtex", "http.server", "concurrent.futures", "ctypes", "pickle", "tracemalloc"]
+
+
+def words(rng: random.Random, count: int):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def person(rng: random.Random, i: int):
+    # the index keeps names unique however many we need
+    return f"{rng.choice(FIRST)} {rng.choice(LAST)}{'' if i < len(LAST) else i}"
+
+
+def generate_site(path: str, sizes, seed: int):
+    rng = random.Random(seed)
+    shutil.copytree(os.path.join(HERE, "templates"), os.path.join(path, "templates"))
+    shutil.copytree(os.path.join(HERE, "data"), os.path.join(path, "data"),
+                    ignore=shutil.ignore_patterns("*.bib", "*.md"))
+    os.makedirs(os.path.join(path, "out", "cv"))
+
+    people = [person(rng, i) for i in range(max(sizes["links"], sizes["authors"] * 4, 1))]
+    linked = people[: sizes["links"]]
+    noted = linked[: sizes["notes"]]
+
+    def mention():
+        return f"{words(rng, 8)} with {rng.choice(people)} {words(rng, 6)}"
+
+    data = {
+        "meta.json": {"name": OWNER, "description": "", "favicon": "", "tracker": ""},
+        "profile.json": {
+            "headshot": "images/headshot.png",
+            "about": " ".join(mention() for _ in range(sizes["profile"] // 16 + 1)),
+            "research": words(rng, 40),
+            "cv": "cv/cv.pdf",
+            "email": "owner@example.com",
+            "scholar": "",
+            "website": "example.com",
+        },
+        "news.json": [
+            {"date": f"{12 - i % 12:02}/{2030 - i // 12}", "text": mention()}
+            for i in range(sizes["news"])
+        ],
+        "auto_links.json": {name: f"https://example.com/{i}" for i, name in enumerate(linked)},
+        "auto_notes.json": {name: f"Note number {i}." for i, name in enumerate(noted)},
+    }
+    for name, contents in data.items():
+        with open(os.path.join(path, "data", name), "w") as f:
+            json.dump(contents, f, indent=4, ensure_ascii=False)
+
+    with open(os.path.join(path, "data", "publications.bib"), "w") as f:
+        for i in range(sizes["pubs"]):
+            authors = rng.sample(people, min(sizes["authors"] - 1, len(people)))
+            authors.insert(rng.randrange(len(authors) + 1), OWNER)
+            f.write(
+                f"@inproceedings{{bench{i},\n"
+                f"  title = {{{words(rng, 10).capitalize()}}},\n"
+                f"  booktitle = {{Proceedings of {words(rng, 4)}}},\n"
+                f"  author = {{{' and '.join(authors)}}},\n"
+                f"  year = {{{2030 - i // 20}}},\n"
+                f"  month = {MONTHS[i % 12]},\n"
+                f"  build_short = {{CONF{i % 30}}},\n"
+                f"  build_keywords = {{{KEYWORDS[i % len(KEYWORDS)]}}},\n"
+                f"  build_selected = {{{'true' if i % 7 == 0 else 'false'}}},\n"
+                f"  build_link = {{https://example.com/paper{i}.pdf}},\n"
+                f"  build_equal_contribution = {{{i % 3}}},\n"
+                f"}}\n\n"
+            )
+
+
+def best_of(repeat: int, fn, setup=None):
+    best = math.inf
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_scale(sizes, repeat: int, seed: int):
+    results = {}
+    with tempfile.TemporaryDirectory() as path, open(os.devnull, "w") as devnull:
+        generate_site(path, sizes, seed)
+        build.config = build.Config(verbosity=-1, prefix=path, target=os.path.join(path, "out"), templates="templates")
+        args = argparse.Namespace(curriculum_vitae=True, fingerprint=False, inline_css=False, optimize_images=False, compress=False, search=False, cv_pdf=False, jobs=1)
+
+        def cold():
+            build.loaded_pubs.clear()
+            shutil.rmtree(os.path.join(path, build.CACHE_DIR), ignore_errors=True)
+
+        # the validated data a build renders from, with its defaults filled in,
+        # and the globals it sets up are what the builders below run on
+        site = {}
+        render_outputs = build.render_outputs
+
+        def capture(outputs, data, jobs):
+            site.update(data)
+            return render_outputs(outputs, data, jobs)
+
+        def build_site():
+            with contextlib.redirect_stdout(devnull):
+                build.build(args, False)
+
+        results["build (cold cache)"] = best_of(repeat, build_site, cold)
+        build.render_outputs = capture
+        results["build (warm cache)"] = best_of(repeat, build_site)
+        build.render_outputs = render_outputs
+
+        pubs_bibtex = build.read_pubs(os.path.join(path, "data", "publications.bib"))
+        pubs_index = site["pubs_index"]
+        links, notes = site["auto_links_json"], site["auto_notes_json"]
+        page = "".join(build.build_pubs(pubs_index, True)) + "".join(build.build_news(site["news_json"], 0, True))
+
+        results["build_authors"] = best_of(repeat, lambda: [
+            build.build_authors(p.persons["author"], 0) for p in pubs_bibtex.entries.values()
+        ])
+        results["build_pubs"] = best_of(repeat, lambda: "".join(build.build_pubs(pubs_index, True)))
+        results["add_links"] = best_of(repeat, lambda: build.add_links(page, links))
+        results["add_notes"] = best_of(repeat, lambda: build.add_notes(page, notes))
+        for output in ["index.html", "news.html", "pubs.html", "cv/cv.tex", "cv/cv.bib"]:
+            name = {"cv/cv.tex": "build_cv", "cv/cv.bib": "build_cv_bib"}.get(output, f"render {output}")
+            results[name] = best_of(repeat, lambda: "".join(build.OUTPUT_BUILDERS[output](site, output)))
+
+    return results
+
+
+def run_build_py(path: str, options):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "build.py", *options], cwd=path, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def imported_modules(path: str, options):
+    # module -> microseconds spent importing it, not counting what it imported
+    run = subprocess.run([sys.executable, "-X", "importtime", "build.py", *options],
+                         cwd=path, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    modules = {}
+    for line in run.stderr.splitlines():
+        m = re.match(r"import time:\s*(\d+) \|\s*\d+ \|\s*(\S+)", line)
+        if m:
+            modules[m.group(2)] = int(m.group(1))
+    return modules
+
+
+def run_python(options):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *options], check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def run_startup(sizes, repeat: int, seed: int, budget: float):
+    results = {}
+    slow = []
+    over = []
+    # what any Python script pays, so the budget is the same on slow machines
+    interpreter = best_of(repeat, lambda: run_python(["-c", "pass"]))
+    with tempfile.TemporaryDirectory() as path:
+        generate_site(path, sizes, seed)
+        shutil.copy(os.path.join(HERE, "build.py"), path)
+        run_build_py(path, ["-o", "out"])
+
+        for name, options in [("--help", ["--help"]), ("no-op --incremental", ["-o", "out", "-i"])]:
+            results[f"startup {name}"] = best_of(repeat, lambda: run_build_py(path, options))
+            modules = imported_modules(path, options)
+            results[f"imports {name}"] = sum(modules.values()) / 1e6
+            slow += [f"{m} ({name})" for m in modules if m.split(".")[0] in SLOW_MODULES or m in SLOW_MODULES]
+            if results[f"startup {name}"] - interpreter > budget:
+                over.append(f"{name}: {(results[f'startup {name}'] - interpreter) * 1e3:.2f}ms over the interpreter")
+
+    width = max(len(n) for n in results)
+    print(f"\n{'startup':<{width}} {'time':>10} {'over python':>12}")
+    print(f"{'python -c pass':<{width}} {interpreter * 1e3:>8.2f}ms")
+    for name, t in results.items():
+        extra = f"{(t - interpreter) * 1e3:>10.2f}ms" if name.startswith("startup") else ""
+        print(f"{name:<{width}} {t * 1e3:>8.2f}ms {extra}".rstrip())
+    return results, slow, over
+
+
+def page_weight(path: str, page: str):
+    # requests and bytes for the page and the local stylesheets and scripts it loads
+    with open(os.path.join(path, page), encoding="utf-8") as f:
+        html = f.read()
+    requests, size, blocking = 1, len(html.encode("utf-8")), 0
+    for tag in re.findall(r"<(?:link\b[^>]*rel=\"stylesheet\"|script\b[^>]*\bsrc=)[^>]*>", html):
+        url = re.search(r'(?:href|src)="([^"]+)"', tag).group(1)
+        if not os.path.exists(os.path.join(path, url)):
+            continue
+        requests += 1
+        size += os.path.getsize(os.path.join(path, url))
+        blocking += "defer" not in tag and "async" not in tag
+    return requests, blocking, size
+
+
+def run_weight(sizes, seed: int):
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        generate_site(path, sizes, seed)
+        shutil.copy(os.path.join(HERE, "build.py"), path)
+        for name, options in [("default", []), ("--inline-css", ["--inline-css"]), ("--fingerprint", ["--fingerprint"])]:
+            out = os.path.join(path, "out-" + name.strip("-"))
+            os.makedirs(os.path.join(out, "cv"))
+            for shipped in ["reset.css", "scroller.js", "mode.js"]:
+                shutil.copy(os.path.join(HERE, "docs", shipped), out)
+            run_build_py(path, ["-o", out, *options])
+            for page in ["index.html", "news.html", "pubs.html"]:
+                results[(page, name)] = page_weight(out, page)
+
+    print(f"\n{'page weight':<28} {'requests':>9} {'blocking':>9} {'bytes':>9}")
+    for (page, name), (requests, blocking, size) in results.items():
+        print(f"{page + ' ' + name:<28} {requests:>9} {blocking:>9} {size:>9}")
+    return results
+
+
+def exponent(scales, times):
+    # least squares slope of log(time) against log(scale)
+    xs = [math.log(s) for s in scales]
+    ys = [math.log(max(t, 1e-9)) for t in times]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    spread = sum((x - mean_x) ** 2 for x in xs)
+    if spread == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread
+
+
+def report(scales, runs):
+    names = list(runs[0].keys())
+    width = max(len(n) for n in names)
+    print(f"\n{'benchmark':<{width}} " + " ".join(f"{'x' + str(s):>10}" for s in scales) + f" {'exponent':>9}")
+    summary = {}
+    for name in names:
+        times = [run[name] for run in runs]
+        slope = exponent(scales, times)
+        summary[name] = {"scales": scales, "times": times, "exponent": slope}
+        slope = "-" if slope is None else f"{slope:.2f}"
+        print(f"{name:<{width}} " + " ".join(f"{t * 1e3:>8.2f}ms" for t in times) + f" {slope:>9}")
+    return summary
+
+
+def compare(summary, baseline, tolerance: float, slack: float):
+    # single points are noisy, so compare the total over the common scales;
+    # the exponent does not depend on how fast this machine is
+    regressions = []
+    for name, result in summary.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        old_times = dict(zip(old["scales"], old["times"]))
+        common = [(t, old_times[s]) for s, t in zip(result["scales"], result["times"]) if s in old_times]
+        new_total, old_total = sum(t for t, _ in common), sum(t for _, t in common)
+        if old_total < 1e-3:
+            # too quick to tell anything from noise
+            continue
+        if new_total > old_total * (1 + tolerance):
+            regressions.append(f"{name}: {old_total * 1e3:.2f}ms -> {new_total * 1e3:.2f}ms over the common scales")
+        if result["exponent"] is not None and old["exponent"] is not None and result["exponent"] > old["exponent"] + slack:
+            regressions.append(f"{name} scales worse: exponent {old['exponent']:.2f} -> {result['exponent']:.2f}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                prog="./bench.py",
+                description="Times build.py on synthetic websites of increasing size.",
+                epilog="For more information, see README.md.")
+
+    parser.add_argument("--scales", type=str, default="1,2,4,8", help="comma separated multipliers for the sizes below (default: 1,2,4,8)")
+    parser.add_argument("--pubs", type=int, default=50, help="publications at scale 1 (default: 50)")
+    parser.add_argument("--authors", type=int, default=6, help="authors per publication, not scaled (default: 6)")
+    parser.add_argument("--news", type=int, default=50, help="news items at scale 1 (default: 50)")
+    parser.add_argument("--links", type=int, default=50, help="auto links at scale 1 (default: 50)")
+    parser.add_argument("--notes", type=int, default=10, help="auto notes at scale 1 (default: 10)")
+    parser.add_argument("--profile", type=int, default=400, help="words in the profile at scale 1 (default: 400)")
+    parser.add_argument("--repeat", type=int, default=5, help="time each benchmark this many times and keep the best (default: 5)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic data (default: 0)")
+    parser.add_argument("--baseline", type=str, default=BASELINE, help="baseline to compare with (default: bench_baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed slowdown against the baseline (default: 0.5, i.e. 50%%)")
+    parser.add_argument("--slack", type=float, default=0.5, help="allowed growth of a scaling exponent (default: 0.5)")
+    parser.add_argument("--startup-budget", type=float, default=100, help="milliseconds --help and a no-op --incremental build may take over `python -c pass` (default: 100)")
+
+    args = parser.parse_args()
+
+    sizes = {
+        "pubs": args.pubs,
+        "authors": args.authors,
+        "news": args.news,
+        "links": args.links,
+        "notes": args.notes,
+        "profile": args.profile,
+        "seed": args.seed,
+    }
+    scales = [int(s) for s in args.scales.split(",")]
+    runs = []
+    for scale in scales:
+        scaled = {k: v if k in ["authors", "seed"] else v * scale for k, v in sizes.items()}
+        print(f"Benchmarking x{scale}: " + ", ".join(f"{v} {k}" for k, v in scaled.items() if k != "seed"), flush=True)
+        runs.append(run_scale(scaled, args.repeat, args.seed))
+
+    summary = report(scales, runs)
+    startup, slow, over = run_startup(sizes, args.repeat, args.seed, args.startup_budget / 1e3)
+    run_weight(sizes, args.seed)
+    if slow:
+        print("\nSlow modules were imported at startup:\n- " + "\n- ".join(slow))
+    if over:
+        print(f"\nStartup took more than its {args.startup_budget:.0f}ms budget:\n- " + "\n- ".join(over))
+    if slow or over:
+        exit(1)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"sizes": sizes, "results": summary, "startup": startup}, f, indent=4, sort_keys=True)
+        print(f"\nSaved the baseline to {args.baseline}")
+        exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to store one.")
+        exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["sizes"] != sizes:
+        print(f"\nThe baseline at {args.baseline} was measured with other sizes: {baseline['sizes']}")
+        exit(0)
+
+    regressions = compare(summary, baseline["results"], args.tolerance, args.slack)
+    for name, t in startup.items():
+        old = baseline.get("startup", {}).get(name)
+        if old is not None and t > old * (1 + args.tolerance):
+            regressions.append(f"{name}: {old * 1e3:.2f}ms -> {t * 1e3:.2f}ms")
+    if regressions:
+        print("\nSlower than the baseline:\n- " + "\n- ".join(regressions))
+        exit(1)
+    print("\nNo regressions against the baseline.")
+    exit(0)
@@ -3,31 +3,55 @@
 import os
 import re
 import json
-import inspect
+import time
+import select
+import filecmp
+import hashlib
 import argparse
-import subprocess
+import functools
+import itertools
+import threading
+import contextlib
 import collections
 
 from typing import Dict, List
-from datetime import datetime
-from pybtex.database import parse_file, Person
+
+# pybtex, http.server, concurrent.futures, and friends are slow to import, so
+# they are imported where they are needed. --help, a build that has nothing
+# to do, and a build without publications never load them.
 
 Config = collections.namedtuple(
     "Config", ["verbosity", "prefix", "target", "templates"]
 )
 
 
-def cleanup():
-    for f in [
-        f"{config.target}/index.html",
-        f"{config.target}/news.html",
-        f"{config.target}/pubs.html",
-        f"{config.target}/main.css",
-    ]:
-        try:
-            os.remove(f)
-        except Exception as _:
-            pass
+# What the builders know about the website being built. Every build starts a
+# new one, --jobs workers get a copy, and --batch builds each site in its own.
+class SiteContext:
+    def __init__(self, config: Config):
+        self.config = config
+        self.meta_json = {}
+        self.style_json = {}
+        self.auto_links_json = {}
+        self.head_html = ""
+        self.footer_html = ""
+        self.paper_template = None
+        self.news_item_template = None
+        self.inline_theme = False
+        # asset -> the name it is written under
+        self.asset_names = {}
+        # src -> Image, with --optimize-images
+        self.images = {}
+        # AuthorName -> (html, html with an equal contribution star)
+        self.rendered_authors = {}
+
+
+def use_site_context(site: SiteContext):
+    # config is read almost everywhere, so it keeps a global of its own
+    global context, config
+
+    context = site
+    config = site.config
 
 
 # for printing with colours
@@ -72,11 +96,10 @@ def warning(msg: str):
 
 def error(msg: str):
     msg = f"ERROR: {msg}"
-    divider = "*" * len(msg)
+    divider = "*" * max(len(line) for line in msg.splitlines())
     msg = f"{divider}\n{msg}\n{divider}"
 
     print(f"{bcolors.ERROR}{msg}{bcolors.ENDC}")
-    cleanup()
     exit(1)
 
 
@@ -90,25 +113,236 @@ def fail_if_not(cond: bool, msg: str):
         error(msg)
 
 
-def fill_if_missing(json: Dict[str, str], field: str, default=""):
-    if not field in json:
-        json[field] = default
+# Profiling
+#
+# --profile times every phase of a build, inclusive and exclusive of the
+# phases nested in it, and the stages each page streams through. Stages are
+# charged only for the time spent producing their own fragments, so the
+# numbers add up. --profile-memory also records what each phase allocated.
+profiling = False
+profile_start = time.perf_counter()
+# time spent in nested phases, one entry per open phase
+profile_stack = []
+# name -> [calls, total seconds, self seconds, bytes allocated]
+profile_totals = {}
+profile_events = []
+
+
+def record_phase(name: str, start: float, total: float, own: float, allocated: int, tid=0):
+    calls, total_sum, own_sum, allocated_sum = profile_totals.get(name, [0, 0.0, 0.0, 0])
+    profile_totals[name] = [calls + 1, total_sum + total, own_sum + own, allocated_sum + allocated]
+    profile_events.append({
+        "name": name,
+        "ph": "X",
+        "pid": os.getpid(),
+        "tid": tid,
+        "ts": (start - profile_start) * 1e6,
+        "dur": total * 1e6,
+        "args": {"self_ms": own * 1e3, "allocated": allocated},
+    })
+
+
+@contextlib.contextmanager
+def phase(name: str):
+    if not profiling:
+        yield
+        return
 
-    return json
+    import tracemalloc
 
+    tracing = tracemalloc.is_tracing()
+    allocated = tracemalloc.get_traced_memory()[0] if tracing else 0
+    profile_stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        total = time.perf_counter() - start
+        nested = profile_stack.pop()
+        if profile_stack:
+            profile_stack[-1] += total
+        allocated = tracemalloc.get_traced_memory()[0] - allocated if tracing else 0
+        record_phase(name, start, total, total - nested, allocated)
+
+
+def profiled(name: str, stream):
+    if not profiling:
+        return stream
+    return profile_stream(name, iter(stream))
+
+
+def profile_stream(name: str, stream):
+    # a stage runs in bits, whenever the next stage asks for a fragment
+    first = time.perf_counter()
+    total = own = 0.0
+    done = object()
+    try:
+        while True:
+            profile_stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                item = next(stream, done)
+            finally:
+                spent = time.perf_counter() - start
+                nested = profile_stack.pop()
+                if profile_stack:
+                    profile_stack[-1] += spent
+                total += spent
+                own += spent - nested
+            if item is done:
+                return
+            yield item
+    finally:
+        record_phase(name, first, total, own, 0, tid=1)
+
+
+def report_profile(trace_path: str):
+    import tracemalloc
+
+    rows = sorted(profile_totals.items(), key=lambda row: row[1][2], reverse=True)
+    width = max([len(name) for name in profile_totals] + [len("phase")])
+    print(f"\n{bcolors.BOLD}{'phase':<{width}} {'calls':>6} {'total ms':>10} {'self ms':>10} {'alloc KiB':>10}{bcolors.ENDC}")
+    for name, (calls, total, own, allocated) in rows:
+        allocated = f"{allocated / 1024:.1f}" if tracemalloc.is_tracing() else "-"
+        print(f"{name:<{width}} {calls:>6} {total * 1e3:>10.2f} {own * 1e3:>10.2f} {allocated:>10}")
+    print(f"{'build':<{width}} {'':>6} {(time.perf_counter() - profile_start) * 1e3:>10.2f}")
+    if tracemalloc.is_tracing():
+        print(f"Peak traced memory: {tracemalloc.get_traced_memory()[1] / 1024:.1f} KiB")
+
+    if trace_path:
+        with open(trace_path, "w") as f:
+            json.dump({"traceEvents": profile_events, "displayTimeUnit": "ms"}, f)
+        status(f"Wrote a Chrome trace of the build to {trace_path}", 0)
+
+
+# Repository origin
+#
+# The origin of the repository the site is built from is read straight from
+# its git config, once per process, instead of spawning git. --origin (or
+# $WEBSITE_ORIGIN) skips the lookup, e.g. for exported copies without .git.
+origin_override = os.environ.get("WEBSITE_ORIGIN")
+
+
+def find_git_dir(path: str):
+    path = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(path, ".git")
+        if os.path.isdir(dot_git):
+            return dot_git
+        if os.path.isfile(dot_git):
+            # worktrees and submodules have a file pointing at their git dir
+            with open(dot_git) as f:
+                line = f.readline().strip()
+            if line.startswith("gitdir:"):
+                return os.path.normpath(os.path.join(path, line[len("gitdir:"):].strip()))
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def glob_regex(pattern: str):
+    # the subset of git's wildmatch that includeIf patterns use
+    if pattern.endswith("/"):
+        pattern += "**"
+
+    regex = ""
+    for part in re.split(r"(\*\*/|\*\*|\*|\?)", pattern):
+        regex += {"**/": "(?:.*/)?", "**": ".*", "*": "[^/]*", "?": "[^/]"}.get(part, re.escape(part))
+    return regex
+
+
+def include_applies(condition: str, config_path: str, git_dir: str):
+    kind, _, pattern = condition.partition(":")
+    if kind in ["gitdir", "gitdir/i"]:
+        if pattern.startswith("~/"):
+            pattern = os.path.expanduser(pattern)
+        elif pattern.startswith("./"):
+            pattern = os.path.join(os.path.dirname(config_path), pattern[2:])
+        elif not os.path.isabs(pattern):
+            pattern = "**/" + pattern
+        flags = re.IGNORECASE if kind == "gitdir/i" else 0
+        return any(
+            re.fullmatch(glob_regex(pattern), d, flags) is not None
+            for d in [git_dir, os.path.realpath(git_dir)]
+        )
+    if kind == "onbranch":
+        try:
+            with open(os.path.join(git_dir, "HEAD")) as f:
+                head = f.read().strip()
+        except OSError:
+            return False
+        branch = head[len("ref: refs/heads/"):] if head.startswith("ref: refs/heads/") else None
+        return branch is not None and re.fullmatch(glob_regex(pattern), branch) is not None
+    return False
 
-def is_federicos(name):
+
+def read_git_config(path: str, git_dir: str, values: Dict[str, str], depth=0):
+    # later values win, like `git config --get`
     try:
-        repo_url = subprocess.getoutput(
-            f"git -C {config.prefix} config --get remote.origin.url"
-        ).split()[0]
-    except Exception as _:
-        repo_url = ""
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return values
+
+    section = ""
+    for line in lines:
+        line = line.strip()
+        if line == "" or line[0] in "#;":
+            continue
+        header = re.match(r'\[\s*([^\s\]"]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]', line)
+        if header:
+            name, subsection = header.groups()
+            section = name.lower() + ("" if subsection is None else "." + subsection.replace('\\"', '"'))
+            line = line[header.end():].strip()
+            if line == "" or line[0] in "#;":
+                continue
+        key, _, value = line.partition("=")
+        key, value = f"{section}.{key.strip().lower()}", value.strip()
+        if value.startswith('"') and value.endswith('"') and len(value) > 1:
+            value = value[1:-1]
+        else:
+            value = re.split(r"\s[#;]", value)[0].strip()
+
+        if key.endswith(".path") and depth < 10 and (
+            section == "include"
+            or section.startswith("includeif.") and include_applies(section[len("includeif."):], path, git_dir)
+        ):
+            value = os.path.expanduser(value)
+            value = value if os.path.isabs(value) else os.path.join(os.path.dirname(path), value)
+            read_git_config(value, git_dir, values, depth + 1)
+        else:
+            values[key] = value
+
+    return values
+
+
+@functools.lru_cache(maxsize=None)
+def repository_origin(prefix: str):
+    if origin_override is not None:
+        return origin_override
 
+    git_dir = find_git_dir(prefix)
+    if git_dir is None:
+        return ""
+
+    # linked worktrees share the config of the main repository
+    common_dir = git_dir
+    try:
+        with open(os.path.join(git_dir, "commondir")) as f:
+            common_dir = os.path.normpath(os.path.join(git_dir, f.read().strip()))
+    except OSError:
+        pass
+
+    values = read_git_config(os.path.join(common_dir, "config"), git_dir, {})
+    return values.get('remote.origin.url', "")
+
+
+def is_federicos(name):
     federicos_url = "git@github.com:FedericoAureliano/FedericoAureliano.github.io.git"
     federicos_name = "Federico Mora Rocha"
 
-    return name == federicos_name and repo_url == federicos_url
+    return name == federicos_name and repository_origin(config.prefix or ".") == federicos_url
 
 
 def check_tracker(tracker):
@@ -123,7 +357,7 @@ def check_tracker(tracker):
 def check_cname():
     status("- Sanity check on CNAME")
 
-    path = os.path.join(config.target, "CNAME")
+    path = os.path.join(config.prefix, config.target, "CNAME")
     try:
         with open(path) as f:
             cname = f.read()
@@ -136,69 +370,725 @@ def check_cname():
     )
 
 
-def read_data(json_file_name: str, optional: bool):
-    path = os.path.join(config.prefix, json_file_name)
+def read_template(template_file_name: str, optional: bool):
+    path = os.path.join(config.prefix, template_file_name)
+    with phase(f"read {template_file_name}"):
+        try:
+            with open(path) as f:
+                status(f"- loading {path}")
+                data = f.read()
+        except Exception as _:
+            fail_if_not(optional, f"Failed to read {path}. Does it exist?")
+            # fail_if_not will exit if needed
+            status(f"Couldn't load {path}---treating it as empty.", 0)
+            data = ""
+
+    return data
+
+
+def write_file(file_name: str, contents):
+    # files are written next to their final place and renamed over it, so the
+    # site never has half-written pages, and unchanged files keep their mtime
+    path = os.path.join(config.prefix, file_name)
+    if contents == "":
+        for p in [path, path + ".gz", path + ".br"]:
+            if os.path.exists(p):
+                status(f"- removing {p}")
+                os.remove(p)
+        return False
+
+    temp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
     try:
-        with open(path) as f:
-            status(f"- loading {path}")
-            data = json.load(f)
+        with open(temp, "w", buffering=1 << 16) as target:
+            if isinstance(contents, str):
+                target.write(contents)
+            else:
+                target.writelines(contents)
+
+        if os.path.exists(path) and filecmp.cmp(temp, path, shallow=False):
+            status(f"- {path} is unchanged")
+            os.remove(temp)
+            return False
+
+        status(f"- writing {path}")
+        os.replace(temp, path)
+        return True
+    except BaseException as _:
+        # error() exits from inside pages that are streamed
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+# Templates
+#
+# Templates are compiled once into their literal segments plus the indices of
+# the slots between them, so rendering an item is a single join. A name like
+# "news-date-placeholder" that has no value is reported when compiling, but
+# CSS vendor selectors like "::-moz-placeholder" are left alone.
+PLACEHOLDER = "-placeholder"
+UNKNOWN_PLACEHOLDER = r"(?<![\w:-])[a-z][\w-]*" + PLACEHOLDER + r"\b"
+PAPER_SLOTS = ["paper-title", "paper-authors", "paper-conference", "paper-icons"]
+NEWS_ITEM_SLOTS = ["news-date", "news-text"]
+
+Template = collections.namedtuple("Template", ["segments", "slots"])
+
+
+# (text, names) -> (Template, unknown placeholders), shared by every site built
+compiled_templates = {}
+
+
+def compile_template(text: str, names: List[str], path: str, warn_missing=False):
+    names = sorted(names, key=len, reverse=True)
+    key = (text, tuple(names))
+    if key not in compiled_templates:
+        segments = []
+        slots = []
+        last = 0
+        if len(names) > 0:
+            pattern = "|".join(re.escape(n + PLACEHOLDER) for n in names)
+            for m in re.finditer(pattern, text):
+                segments.append(text[last : m.start()])
+                slots.append((len(segments), m.group()[: -len(PLACEHOLDER)]))
+                segments.append("")
+                last = m.end()
+        segments.append(text[last:])
+
+        unknown = []
+        for segment in segments:
+            unknown += re.findall(UNKNOWN_PLACEHOLDER, segment)
+        compiled_templates[key] = (Template(segments, slots), unknown)
+
+    template, unknown = compiled_templates[key]
+    if warn_missing:
+        used = set(name for _, name in template.slots)
+        for name in names:
+            warn_if_not(name in used, f"{path} has no {name}{PLACEHOLDER}")
+
+    fail_if_not(
+        len(unknown) == 0,
+        f"Unknown placeholders in {path}: {', '.join(sorted(set(unknown)))}",
+    )
+
+    return template
+
+
+def render(template: Template, values: Dict[str, str]):
+    segments = list(template.segments)
+    for i, name in template.slots:
+        segments[i] = values[name]
+
+    return "".join(segments)
+
+
+def replace_placeholders(text: str, map: Dict[str, str], path: str):
+    return render(compile_template(text, list(map.keys()), path), map)
+
+
+# Incremental builds
+#
+# The manifest remembers, for every output we wrote, the hash of each input
+# it was rendered from. With --incremental an output is only rebuilt if one
+# of those hashes changed or it went missing. It is kept in .cache/, one per
+# output directory, so it is never published with the website.
+MANIFEST = "manifest-%s.json"
+# where earlier builds kept it
+OLD_MANIFEST = ".manifest.json"
+
+OUTPUT_INPUTS = {
+    "index.html": [
+        "data/meta.json", "data/style.json", "data/profile.json", "data/news.json",
+        "data/publications.bib", "data/auto_links.json", "data/auto_notes.json",
+        "{templates}/head.html", "{templates}/footer.html", "{templates}/paper.html",
+        "{templates}/news-item.html", "{templates}/light.css", "{templates}/dark.css",
+    ],
+    "news.html": [
+        "data/meta.json", "data/news.json", "data/auto_links.json", "data/auto_notes.json",
+        "{templates}/head.html", "{templates}/footer.html", "{templates}/news-item.html",
+        "{templates}/light.css", "{templates}/dark.css",
+    ],
+    "pubs.html": [
+        "data/meta.json", "data/style.json", "data/publications.bib",
+        "data/auto_links.json", "data/auto_notes.json",
+        "{templates}/head.html", "{templates}/footer.html", "{templates}/paper.html",
+        "{templates}/light.css", "{templates}/dark.css",
+    ],
+    "main.css": ["data/style.json", "{templates}/main.css"],
+    "light.css": ["data/style.json", "{templates}/light.css"],
+    "dark.css": ["data/style.json", "{templates}/light.css", "{templates}/dark.css"],
+    "reset.css": ["{target}/reset.css"],
+    "scroller.js": ["{target}/scroller.js"],
+    "mode.js": ["{target}/mode.js", "data/style.json", "{templates}/light.css", "{templates}/dark.css"],
+    "search.js": ["{target}/search.js"],
+    "search.json": ["data/meta.json", "data/news.json", "data/publications.bib"],
+    "cv/cv.tex": [
+        "data/meta.json", "data/profile.json", "data/education.json", "data/publications.bib",
+        "data/presentations.json", "data/teaching.json", "data/work.json", "data/service.json",
+        "data/awards.json", "data/volunteer.json", "data/languages.json",
+    ],
+    "cv/cv.bib": ["data/meta.json", "data/publications.bib"],
+}
+
+
+def hash_file(path: str):
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
     except Exception as _:
-        fail_if_not(
-            optional,
-            f"Failed to parse {path}. Check your commas, braces, and if the file exists.",
-        )
-        # fail_if_not will exit if needed so the code below will only run if this data is optional
-        status(f"Failed to load {path}---treating it as empty.", 0)
-        data = {}
+        return ""
 
-    return data
 
+def output_inputs(output: str):
+    inputs = [i.format(templates=config.templates, target=config.target) for i in OUTPUT_INPUTS[output]]
+    return inputs + [os.path.basename(__file__)]
 
-def read_template(template_file_name: str, optional: bool):
-    path = os.path.join(config.prefix, template_file_name)
+
+def input_hashes(output: str, cache: Dict[str, str]):
+    hashes = {}
+    for i in output_inputs(output):
+        if i not in cache:
+            # build.py is recorded by name but isn't in the site's prefix with --batch
+            path = __file__ if i == os.path.basename(__file__) else os.path.join(config.prefix, i)
+            cache[i] = hash_file(path)
+        hashes[i] = cache[i]
+
+    return hashes
+
+
+def is_stale(output: str, manifest, hashes: Dict[str, str]):
+    # sharded pages are recorded under their own names, with output as family
+    records = {o: r for o, r in manifest.items() if r.get("family", o) == output}
+    if len(records) == 0:
+        return True
+
+    for o, record in records.items():
+        if record["inputs"] != hashes:
+            return True
+        path = os.path.join(config.prefix, config.target, o)
+        if record["written"] and not os.path.exists(path):
+            return True
+
+    return False
+
+
+def manifest_name():
+    target = re.sub(r"[^\w.-]+", "_", os.path.normpath(config.target)).strip("_")
+    return os.path.join(CACHE_DIR, MANIFEST % target)
+
+
+def read_manifest():
+    path = os.path.join(config.prefix, manifest_name())
     try:
         with open(path) as f:
+            return json.load(f)
+    except Exception as _:
+        status(f"- couldn't load {path}---rebuilding everything")
+        return {}
+
+
+def write_manifest(manifest):
+    os.makedirs(os.path.join(config.prefix, CACHE_DIR), exist_ok=True)
+    write_file(manifest_name(), json.dumps(manifest, indent=4, sort_keys=True))
+    write_file(f"{config.target}/{OLD_MANIFEST}", "")
+
+
+# Data schemas
+#
+# Every data file is checked against its schema in one pass that fills in
+# defaults and collects every problem, so they can all be reported at once.
+# A schema lists the fields of the file (or of each item, for files that are
+# lists) with their defaults, and checks on their values. Validated files are
+# cached in the cache directory by their hash and the hash of build.py.
+REQUIRED = None
+# a default that is the value of another field
+SameAs = collections.namedtuple("SameAs", ["field"])
+# item is what each entry of a list is called in messages, or None for objects
+Schema = collections.namedtuple("Schema", ["item", "optional", "fields", "checks"])
+
+DATA_CACHE = "data.json"
+
+
+def is_month(value):
+    m = re.fullmatch(r"(\d{1,2})/\d{4}", value) if isinstance(value, str) else None
+    return m is not None and 1 <= int(m.group(1)) <= 12
+
+
+def is_pages(value, groups: List[str]):
+    return value in [""] + groups or (type(value) == int and value > 0)
+
+
+STYLE_FIELDS = [
+    "font-color", "background-color", "header-color", "accent-color", "link-hover-color", "divider-color",
+    "paper-img", "extra-img", "slides-img", "bibtex-img",
+]
+
+SCHEMAS = {
+    "data/meta.json": Schema(None, False, [
+        ("name", REQUIRED), ("description", REQUIRED), ("favicon", REQUIRED),
+        ("tracker", ""), ("news-pages", ""), ("pubs-pages", ""),
+    ], [
+        ("news-pages", lambda v: is_pages(v, ["year"]), 'The "news-pages" in data/meta.json must be a positive number or "year"!'),
+        ("pubs-pages", lambda v: is_pages(v, ["year", "keyword"]), 'The "pubs-pages" in data/meta.json must be a positive number, "year", or "keyword"!'),
+    ]),
+    "data/style.json": Schema(
+        None, False, [(f, REQUIRED) for f in STYLE_FIELDS] + [(f + "-dark", SameAs(f)) for f in STYLE_FIELDS], []
+    ),
+    "data/profile.json": Schema(
+        None, False, [("headshot", REQUIRED), ("about", REQUIRED), ("cv", REQUIRED), ("email", REQUIRED), ("scholar", REQUIRED)], []
+    ),
+    "data/news.json": Schema("news", True, [("date", REQUIRED), ("text", REQUIRED)], [
+        ("date", is_month, 'The "date" of each news in data/news.json must be a month, like "05/2024"!'),
+    ]),
+    "data/presentations.json": Schema(
+        "presentation", True, [("date", REQUIRED), ("title", REQUIRED), ("venue", REQUIRED), ("category", REQUIRED)], []
+    ),
+    "data/education.json": Schema(
+        "education", True, [("year", REQUIRED), ("degree", REQUIRED), ("note", ""), ("institution", REQUIRED)], []
+    ),
+    "data/teaching.json": Schema("teaching", True, [("date", REQUIRED), ("program", REQUIRED), ("role", REQUIRED), ("bullets", "")], []),
+    "data/work.json": Schema("work", True, [("date", REQUIRED), ("role", REQUIRED), ("company", REQUIRED), ("bullets", "")], []),
+    "data/service.json": Schema(
+        "service", True, [("date", REQUIRED), ("role", REQUIRED), ("organization", REQUIRED), ("bullets", "")], []
+    ),
+    "data/awards.json": Schema("award", True, [("date", REQUIRED), ("text", REQUIRED)], []),
+    "data/volunteer.json": Schema("volunteer", True, [("date", REQUIRED), ("title", REQUIRED), ("bullets", "")], []),
+    "data/languages.json": Schema("language", True, [("language", REQUIRED), ("level", REQUIRED), ("evidence", "")], []),
+    "data/auto_links.json": Schema(None, True, [], []),
+    "data/auto_notes.json": Schema(None, True, [], []),
+}
+
+# publications.bib, for each entry; "author" is checked separately
+PUB_SCHEMA = Schema("pub", False, [
+    ("year", REQUIRED), ("title", REQUIRED), ("build_short", REQUIRED),
+    ("build_link", ""), ("build_extra", ""), ("build_slides", ""), ("build_bibtex", ""),
+    ("build_keywords", REQUIRED), ("build_selected", REQUIRED),
+], [])
+
+
+def check_item(item, schema: Schema, file_name: str, where: str, errors):
+    # errors maps each message to where it happened
+    for field, default in schema.fields:
+        if field in item:
+            continue
+        if default is REQUIRED:
+            each = f" field for each {schema.item}" if schema.item else ""
+            errors.setdefault(f'Must include a "{field}"{each} in {file_name}!', []).append(where)
+        elif isinstance(default, SameAs):
+            if default.field in item:
+                item[field] = item[default.field]
+        else:
+            item[field] = default
+
+    for field, check, message in schema.checks:
+        if field in item and not check(item[field]):
+            errors.setdefault(message, []).append(where)
+
+
+def check_data(data, schema: Schema, file_name: str):
+    errors = {}
+    if schema.item is None:
+        if isinstance(data, dict):
+            check_item(data, schema, file_name, "", errors)
+        else:
+            errors[f"{file_name} must hold an object, in braces!"] = [""]
+    elif isinstance(data, list):
+        for i, item in enumerate(data):
+            if isinstance(item, dict):
+                check_item(item, schema, file_name, f"#{i + 1}", errors)
+            else:
+                errors.setdefault(f"Each {schema.item} in {file_name} must be an object, in braces!", []).append(f"#{i + 1}")
+    else:
+        errors[f"{file_name} must hold a list, in brackets!"] = [""]
+
+    return [message + (" (%s)" % ", ".join(where) if where != [""] else "") for message, where in errors.items()]
+
+
+# validated data files that are already in memory, by path, for long-running builds
+loaded_data = {}
+
+
+def validate_data(file_names: List[str]):
+    # returns the validated data, by file name, and every problem found
+    version = hash_file(__file__)
+    cache_path = os.path.join(config.prefix, CACHE_DIR, DATA_CACHE)
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+        cache = cache if cache.get("version") == version else {}
+    except Exception as _:
+        cache = {}
+    files = cache.get("files", {})
+
+    data = {}
+    errors = []
+    for name in file_names:
+        schema = SCHEMAS[name]
+        path = os.path.join(config.prefix, name)
+        with phase(f"read {name}"):
+            try:
+                with open(path, "rb") as f:
+                    source = f.read()
+            except OSError as _:
+                source = None
+
+            digest = hashlib.sha256(source).hexdigest() if source is not None else ""
+            if path in loaded_data and loaded_data[path][0] == digest:
+                data[name] = loaded_data[path][1]
+                continue
+            if files.get(name, {}).get("hash") == digest:
+                status(f"- loading {path} from {cache_path}")
+                data[name] = files[name]["data"]
+                loaded_data[path] = (digest, data[name])
+                continue
+
             status(f"- loading {path}")
-            data = f.read()
+            try:
+                data[name] = json.loads(source)
+            except Exception as _:
+                if source is not None or not schema.optional:
+                    errors.append(f"Failed to parse {path}. Check your commas, braces, and if the file exists.")
+                    continue
+                # status, not an error, since the file is optional
+                status(f"Failed to load {path}---treating it as empty.", 0)
+                data[name] = {} if schema.item is None else []
+
+            problems = check_data(data[name], schema, name)
+            errors += problems
+            if len(problems) == 0:
+                files[name] = {"hash": digest, "data": data[name]}
+                loaded_data[path] = (digest, data[name])
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "w") as f:
+            json.dump({"version": version, "files": files}, f)
+    except Exception as _:
+        status(f"- couldn't write {cache_path}---continuing without it")
+
+    return data, errors
+
+
+def fail_if_any(errors: List[str]):
+    if len(errors) > 0:
+        error("\n".join(errors))
+
+
+# Publications
+#
+# Parsing publications.bib is the slowest part of a build, so the validated
+# entries are pickled into the cache directory, keyed by the hash of the .bib
+# file, the pybtex version, and the hash of build.py. When the .bib file
+# changes, only the entries whose source block changed are parsed again.
+CACHE_DIR = ".cache"
+BIB_CACHE = "publications.pickle"
+
+# publications that are already in memory, by path, for long-running builds
+loaded_pubs = {}
+
+
+def validate_pub(pub):
+    errors = {}
+    check_item(pub.fields, PUB_SCHEMA, "data/publications.bib", pub.key, errors)
+    if "journal" not in pub.fields and "booktitle" not in pub.fields:
+        errors['Must include a "journal" or "booktitle" field for each pub in data/publications.bib!'] = [pub.key]
+    if len(pub.persons["author"]) == 0:
+        errors['Must include an "author" field for each pub in data/publications.bib!'] = [pub.key]
+
+    return errors
+
+
+def pub_errors(errors):
+    # validate_pub's messages, with every entry they apply to
+    return [f"{message} ({', '.join(where)})" for message, where in errors.items()]
+
+
+def split_bib(source: str):
+    blocks = []
+    start = 0
+    depth = 0
+    for m in re.finditer(r"[{}@]", source):
+        if m.group() == "{":
+            depth += 1
+        elif m.group() == "}":
+            depth = max(depth - 1, 0)
+        elif depth == 0 and m.start() > start:
+            blocks.append(source[start : m.start()])
+            start = m.start()
+    blocks.append(source[start:])
+
+    return blocks
+
+
+# Entries are parsed through a store shared by every site a process builds.
+# An entry is normalized by dropping its key and its build_* fields, which
+# only say how one website shows it, collapsing whitespace, and writing every
+# braced, quoted, or numeric value in braces. The store is keyed by a hash of
+# the normalized entry, so a co-authored paper is parsed once however many
+# sites list it the same way, and only its key and build_* fields are per
+# site. Sites that disagree about any other field get their own entries, so
+# no site shows another's version of a paper.
+# hash -> parsed entry, without key or build_* fields
+entry_store = {}
+
+
+def split_entry(block: str):
+    # (type, key, [(field, raw value)]), or None if it isn't a plain entry
+    m = re.match(r"\s*@\s*(\w+)\s*\{", block)
+    if m is None or m.group(1).lower() in ["comment", "string", "preamble"]:
+        return None
+
+    parts = []
+    depth = 1
+    quoted = False
+    start = m.end()
+    for t in re.compile(r'[{}",]').finditer(block, m.end()):
+        c = t.group()
+        if c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                parts.append(block[start : t.start()])
+                break
+        elif c == '"' and depth == 1:
+            quoted = not quoted
+        elif c == "," and depth == 1 and not quoted:
+            parts.append(block[start : t.start()])
+            start = t.end()
+    else:
+        return None
+
+    fields = []
+    for part in parts[1:]:
+        name, equals, value = part.partition("=")
+        if equals == "":
+            if part.strip() == "":
+                continue
+            return None
+        fields.append((name.strip(), value.strip()))
+
+    return m.group(1), parts[0].strip(), fields
+
+
+def bib_text(value: str):
+    # what pybtex reads from a braced, quoted, or numeric value, or None
+    if value.isdigit():
+        return value
+    if value[:1] == '"' and value[-1:] == '"' and '"' not in value[1:-1]:
+        return " ".join(value[1:-1].split())
+    if value[:1] == "{" and value[-1:] == "}":
+        depth = 0
+        for i, c in enumerate(value):
+            depth += {"{": 1, "}": -1}.get(c, 0)
+            if depth == 0:
+                return " ".join(value[1:-1].split()) if i == len(value) - 1 else None
+    return None
+
+
+def shared_value(value: str):
+    # the same value however it is quoted, as pybtex would read it
+    text = bib_text(value)
+    if text is None or text.count("{") != text.count("}"):
+        return " ".join(value.split())
+    return "{%s}" % text
+
+
+def resolve_entry(block: str):
+    # the entry in block, parsed through the store, or None to parse it alone
+    from pybtex.database import parse_string, Entry
+
+    split = split_entry(block)
+    if split is None:
+        return None
+    kind, key, fields = split
+
+    shared = [(name, shared_value(value)) for name, value in fields if not name.lower().startswith("build_")]
+    build = [(name, bib_text(value)) for name, value in fields if name.lower().startswith("build_")]
+    if any(value is None for _, value in build):
+        return None
+
+    normalized = "@%s{entry,\n%s\n}\n" % (kind, ",\n".join(f"{name} = {value}" for name, value in shared))
+    digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+    if digest not in entry_store:
+        parsed = list(parse_string(normalized, "bibtex").entries.values())
+        if len(parsed) != 1:
+            return None
+        entry_store[digest] = parsed[0]
+    stored = entry_store[digest]
+
+    # the fields and people are shared with every site, and never changed
+    pub = Entry(stored.original_type, list(stored.fields.items()) + build + [("build_digest", digest)], stored.persons)
+    pub.key = key
+    return pub
+
+
+def parse_pubs_granular(source: str, cached_blocks, errors):
+    from pybtex.database import parse_string, BibliographyData
+
+    blocks = {}
+    entries = []
+    for block in split_bib(source):
+        if re.match(r"\s*@\s*(string|preamble)", block, re.IGNORECASE):
+            return None, {}
+
+        digest = hashlib.sha256(block.encode("utf-8")).hexdigest()
+        if digest not in cached_blocks:
+            status(f"- parsing changed block {block.split(',')[0].strip()}", 2)
+            pub = resolve_entry(block)
+            parsed = [pub] if pub is not None else list(parse_string(block, "bibtex").entries.values())
+            problems = {}
+            for pub in parsed:
+                for message, where in validate_pub(pub).items():
+                    problems.setdefault(message, []).extend(where)
+            for message, where in problems.items():
+                errors.setdefault(message, []).extend(where)
+            if len(problems) > 0:
+                entries += [(pub.key, pub) for pub in parsed]
+                continue
+            cached_blocks[digest] = parsed
+        blocks[digest] = cached_blocks[digest]
+        entries += [(pub.key, pub) for pub in blocks[digest]]
+
+    return BibliographyData(entries=entries), blocks
+
+
+def read_pubs(path: str, problems: List[str] = None):
+    # None when there are no publications; problems are added to problems if
+    # given, and reported right away otherwise
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as f:
+        source = f.read()
+
+    digest = hashlib.sha256(source).hexdigest()
+    # batch builds share publications between sites with the same .bib file
+    for loaded_digest, pubs in loaded_pubs.values():
+        if loaded_digest == digest:
+            loaded_pubs[path] = (digest, pubs)
+            return pubs
+
+    import pickle
+    from pybtex import __version__ as pybtex_version
+    from pybtex.database import parse_file
+
+    version = [pybtex_version, hash_file(__file__)]
+    cache_path = os.path.join(config.prefix, CACHE_DIR, BIB_CACHE)
+    try:
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)
+    except Exception as _:
+        cache = {}
+
+    if cache.get("version") != version:
+        cache = {"version": version, "hash": "", "blocks": {}}
+    elif cache["hash"] == digest:
+        status(f"- loading {path} from {cache_path}")
+        author_names.update(cache["authors"])
+        loaded_pubs[path] = (digest, cache["pubs"])
+        return cache["pubs"]
+
+    status(f"- loading {path}")
+    errors = {}
+    try:
+        pubs, blocks = parse_pubs_granular(source.decode("utf-8"), cache["blocks"], errors)
     except Exception as _:
-        fail_if_not(optional, f"Failed to read {path}. Does it exist?")
-        # fail_if_not will exit if needed
-        status(f"Couldn't load {path}---treating it as empty.", 0)
-        data = ""
+        # let the full parse below report the error with the right line numbers
+        pubs, blocks = None, {}
+
+    if pubs is None:
+        pubs = parse_file(path)
+        errors = {}
+        for pub in pubs.entries.values():
+            for message, where in validate_pub(pub).items():
+                errors.setdefault(message, []).extend(where)
+
+    if len(errors) > 0:
+        if problems is None:
+            fail_if_any(pub_errors(errors))
+        problems += pub_errors(errors)
+        return pubs
+
+    for pub in pubs.entries.values():
+        for person in pub.persons["author"]:
+            author_name(person)
+
+    cache.update(hash=digest, pubs=pubs, blocks=blocks, authors=author_names)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "wb") as f:
+            pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+    except Exception as _:
+        status(f"- couldn't write {cache_path}---continuing without it")
 
-    return data
+    loaded_pubs[path] = (digest, pubs)
+    return pubs
 
 
-def write_file(file_name: str, contents: str):
-    path = os.path.join(config.prefix, file_name)
-    if contents == "":
-        return
+# Authors
+#
+# The same people appear on many papers, so the parts of their names we use
+# are worked out once per person and saved with the cached publications. How
+# an author is shown also depends on the auto links and on whose website this
+# is, so that is worked out once per person per build, in the site context.
+AuthorName = collections.namedtuple("AuthorName", ["short", "full", "plain"])
+# (first, middle, last names) -> AuthorName
+author_names = {}
 
-    with open(path, "w") as target:
-        status(f"- writing {path}")
-        target.write(contents)
 
+def author_name(person):
+    key = (tuple(person.first_names), tuple(person.middle_names), tuple(person.last_names))
+    name = author_names.get(key)
+    if name is None:
+        first = " ".join(person.first_names)
+        middle = " ".join(person.middle_names)
+        last = " ".join(person.last_names)
+
+        short = first[0] + ". " + (middle[0] + ". " if len(person.middle_names) > 0 else "") + last
+        full = first + ("" if len(person.middle_names) == 0 else " " + middle) + " " + last
+        name = author_names[key] = AuthorName(short, full, full.replace("{", "").replace("}", ""))
 
-def replace_placeholders(text: str, map: Dict[str, str]):
-    newtext = text
+    return name
 
-    for k in map:
-        newtext = newtext.replace(k + "-placeholder", map[k])
 
-    return newtext
+def render_author(person):
+    name = author_name(person)
+    rendered = context.rendered_authors.get(name)
+    if rendered is None:
+        rendered = []
+        for entry in [name.short, name.short + "*"]:
+            if name.full in context.auto_links_json:
+                entry = '<a href="%s">%s</a>' % (context.auto_links_json[name.full], entry)
+            if name.plain == context.meta_json["name"]:
+                entry = '<strong>%s</strong>' % (entry)
+            rendered.append(entry.replace("{", "").replace("}", ""))
+        rendered = context.rendered_authors[name] = tuple(rendered)
+
+    return rendered
 
 
 # Define functions for website pieces
 
 
 def header(has_dark):
-    if has_dark:
+    if has_dark and context.inline_theme:
         button = """<label class="switch-mode">
     <input type="checkbox" id="mode">
     <span class="slider round"></span>
 </label>
-<script src="mode.js"></script>
+<script>
+var mode = document.getElementById("mode");
+mode.checked = document.documentElement.classList.contains("dark");
+mode.addEventListener("change", function() { document.documentElement.classList.toggle("dark", mode.checked); });
+</script>
 """
+    elif has_dark:
+        button = """<label class="switch-mode">
+    <input type="checkbox" id="mode">
+    <span class="slider round"></span>
+</label>
+<script src="%s"></script>
+""" % asset("mode.js")
     else:
         button = ""
 
@@ -206,101 +1096,88 @@ def header(has_dark):
     return out
 
 
-def build_news(news: List[Dict[str, str]], count: int, standalone: bool):
+def build_news(news: List[Dict[str, str]], count: int, standalone: bool, more: str = "news.html"):
     if count > len(news):
         count = len(news)
 
     if count <= 0:
-        return ""
+        return
 
     status("\nAdding news:")
-    news_list = ""
 
-    for n in news[:count]:
-        status("- " + n["date"])
-        news_map = {
-            "news-date": n["date"],
-            "news-text": n["text"],
-        }
-        news_list += replace_placeholders(news_item_html, news_map)
-
-    news_html = '<div class="section">\n'
+    yield '<div class="section">\n'
 
     if count != len(news):
-        link = '<a href="./news.html">See all posts</a>'
-        news_html += (
+        link = '<a href="./%s">See all posts</a>' % more
+        yield (
             '<h1>Recent News <small style="font-weight: 300; float: right; padding-top: 0.23em">(%s)</small></h1>\n'
             % link
         )
     elif standalone:
-        link = '<a href="./index.html">%s</a>' % meta_json["name"]
-        news_html += (
+        link = '<a href="./index.html">%s</a>' % context.meta_json["name"]
+        yield (
             '<h1>News <small style="font-weight: 300; float: right; padding-top: 0.23em">%s</small></h1>\n'
             % link
         )
     else:
-        news_html += "<h1>News</h1>\n"
+        yield "<h1>News</h1>\n"
 
-    news_html += '<div class="hbar"></div>\n'
-    news_html += '<div id="news">\n'
-    news_html += news_list
-    news_html += "</div>\n"  # close news
-    news_html += "</div>\n"  # close section
+    yield '<div class="hbar"></div>\n'
+    yield '<div id="news">\n'
+
+    for n in news[:count]:
+        status("- " + n["date"])
+        news_map = {
+            "news-date": n["date"],
+            "news-text": n["text"],
+        }
+        yield render(context.news_item_template, news_map)
 
-    return news_html
+    yield "</div>\n"  # close news
+    yield "</div>\n"  # close section
 
 
-# Helper function to decide what publication sections to include
-def get_pub_titles(pubs, full: bool):
-    titles = set()
-    for p in pubs.entries.values():
-        if p.fields["build_selected"] == "true" or full:
-            titles.add(p.fields["build_keywords"])
+# Publications are indexed once per build: grouped by section, and by whether
+# they are selected for the front page, newest first (then by month and key).
+MONTHS = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
 
-    return sorted(list(titles))
+PubIndex = collections.namedtuple("PubIndex", ["all", "selected", "some_not_selected"])
 
 
-def some_not_selected(pubs):
-    for p in pubs.entries.values():
-        if not p.fields["build_selected"] == "true":
-            return True
+def pub_month(p):
+    month = p.fields["month"].strip().lower() if "month" in p.fields else ""
+    if month.isdigit():
+        return int(month)
 
-    return False
+    return MONTHS.index(month[:3]) + 1 if month[:3] in MONTHS else 0
 
 
-def build_authors(authors, equal_contribution):
-    item = ""
+def index_pubs(pubs):
+    ordered = sorted(pubs.entries.values() if pubs is not None else [], key=lambda x: x.key)
+    ordered.sort(key=lambda x: (x.fields["year"], pub_month(x)), reverse=True)
 
-    authors_split = []
-    for i in range(len(authors)):
-        a = authors[i]
+    return index_entries(ordered)
 
-        entry = "%s%s%s" % (
-            " ".join(a.first_names)[0] + ". ",
-            " ".join(a.middle_names)[0] + ". " if len(a.middle_names) > 0 else "",
-            " ".join(a.last_names),
-        )
 
-        if i < equal_contribution:
-            entry = entry + "*"
+def index_entries(ordered):
+    index = PubIndex({}, {}, False)
+    for p in ordered:
+        index.all.setdefault(p.fields["build_keywords"], []).append(p)
+        if p.fields["build_selected"] == "true":
+            index.selected.setdefault(p.fields["build_keywords"], []).append(p)
         else:
-            entry = entry
+            index = index._replace(some_not_selected=True)
 
-        name = " ".join(a.first_names)
-        name += "" if len(a.middle_names) == 0 else " " + " ".join(a.middle_names)
-        name += " " + " ".join(a.last_names)
-        if name in auto_links_json:
-            entry = '<a href="%s">%s</a>' % (auto_links_json[name], entry)
+    return index
 
-        first = " ".join(a.first_names) + " "
-        middle = " ".join(a.middle_names) + " " if len(a.middle_names) > 0 else ""
-        last = " ".join(a.last_names)
-        name = first + middle + last
-        name = name.replace("{", "").replace("}", "")
-        if name == meta_json["name"]:
-            entry = '<strong>%s</strong>' % (entry)
 
-        authors_split.append(entry)
+# Helper function to decide what publication sections to include
+def get_pub_titles(pubs_index: PubIndex, full: bool):
+    return sorted(pubs_index.all if full else pubs_index.selected)
+
+
+def build_authors(authors, equal_contribution):
+    authors_split = [render_author(a)[i < equal_contribution] for i, a in enumerate(authors)]
 
     for i in range(len(authors_split)):
         entry = authors_split[i]
@@ -310,128 +1187,138 @@ def build_authors(authors, equal_contribution):
             entry += " and\n"
         authors_split[i] = entry
 
-    item += "".join(authors_split).replace("{", "").replace("}", "")
-    return item
+    return "".join(authors_split)
 
 
-def build_icons(p):
-    item = ""
-    item += (
-        '<a href="'
-        + p.fields["build_link"]
-        + '" alt="[PDF] "><img class="paper-icon" src="%s"/><img class="paper-icon-dark" src="%s"/></a>'
-        % (style_json["paper-img"], style_json["paper-img-dark"])
-        if p.fields["build_link"]
-        else ""
-    )
-    item += (
-        '<a href="'
-        + p.fields["build_extra"]
-        + '" alt="[Extra] "><img class="paper-icon" src="%s"/><img class="paper-icon-dark" src="%s"/></a>'
-        % (style_json["extra-img"], style_json["extra-img-dark"])
-        if p.fields["build_extra"]
-        else ""
-    )
-    item += (
-        '<a href="'
-        + p.fields["build_slides"]
-        + '" alt="[Slides] "><img class="paper-icon" src="%s"/><img class="paper-icon-dark" src="%s"/></a>'
-        % (style_json["slides-img"], style_json["slides-img-dark"])
-        if p.fields["build_slides"]
-        else ""
-    )
-    item += (
-        '<a href="'
-        + p.fields["build_bibtex"]
-        + '" alt="[Bibtex] "><img class="paper-icon" src="%s"/><img class="paper-icon-dark" src="%s"/></a>'
-        % (style_json["bibtex-img"], style_json["bibtex-img-dark"])
-        if p.fields["build_bibtex"]
-        else ""
+ICON_FIELDS = [
+    ("build_link", "[PDF] ", "paper-img"),
+    ("build_extra", "[Extra] ", "extra-img"),
+    ("build_slides", "[Slides] ", "slides-img"),
+    ("build_bibtex", "[Bibtex] ", "bibtex-img"),
+]
+
+
+def icon_images():
+    # the light and dark <img> of each icon, for this site
+    return tuple(
+        image_html(context.style_json[icon], "paper-icon") + image_html(context.style_json[icon + "-dark"], "paper-icon-dark")
+        for _, _, icon in ICON_FIELDS
     )
+
+
+def build_icons(p, images):
+    item = ""
+    for (field, alt, _), image in zip(ICON_FIELDS, images):
+        if p.fields[field]:
+            item += '<a href="%s" alt="%s">%s</a>' % (p.fields[field], alt, image)
     return item
 
 
-def build_pubs_inner(pubs, title: str, full: bool, only: bool = False):
-    if title == "":
-        return ""
+# Rendered papers, split around their authors, for entries from the entry
+# store: everything but the authors (where each site bolds its owner) is the
+# same for every site with the same paper.html and icons.
+# (entry hash, build_* fields shown, paper.html, icons) -> fragments
+paper_fragments = {}
 
-    pubs_list = ""
 
-    sorted_pubs = sorted(pubs.entries.values(), key=lambda x: x.fields["year"], reverse=True)
+def paper_fragments_for(p, images):
+    fields = tuple(p.fields[f] for f in ["build_short", "build_link", "build_extra", "build_slides", "build_bibtex"])
+    key = (p.fields.get("build_digest"), fields, id(context.paper_template), images)
+    if key[0] is not None and key in paper_fragments:
+        return paper_fragments[key]
 
-    for p in sorted_pubs:
-        if title == p.fields["build_keywords"] and (p.fields["build_selected"] == "true" or full):
-            status("- " + p.fields["title"])
+    paper_conference = p.fields["build_short"] + " '" + p.fields["year"][-2:]
+    if len(paper_conference) > 8:
+        paper_conference = f'<div class="bigscreen"><small>{paper_conference}</small></div><div class="smallscreen">{paper_conference}</div>'
 
-            paper_conference = p.fields["build_short"] + " '" + p.fields["year"][-2:]
-            if len(paper_conference) > 8:
-                paper_conference = f'<div class="bigscreen"><small>{paper_conference}</small></div><div class="smallscreen">{paper_conference}</div>'
+    title_split = p.fields["title"].split()
+    paper_title = " ".join(title_split)
 
-            title_split = p.fields["title"].split()
-            paper_title = " ".join(title_split)
+    paper_map = {
+        "paper-title": paper_title,
+        "paper-authors": "\0",
+        "paper-conference": paper_conference,
+        "paper-icons": build_icons(p, images),
+    }
+    fragments = render(context.paper_template, paper_map).split("\0")
+    if key[0] is not None:
+        paper_fragments[key] = fragments
+    return fragments
 
-            if "build_equal_contribution" in p.fields:
-                equal_contribution = int(p.fields["build_equal_contribution"])
-            else:
-                equal_contribution = 0
 
-            paper_map = {
-                "paper-title": paper_title,
-                "paper-authors": build_authors(p.persons['author'], equal_contribution),
-                "paper-conference": paper_conference,
-                "paper-icons": build_icons(p),
-            }
-            pubs_list += replace_placeholders(paper_html, paper_map)
+# site prefix -> (entry hashes, (paper.html, icons)) of its latest build
+shared_users = {}
+
+
+def forget_shared(pubs):
+    # drop entries and fragments that no site uses any more, for long-running builds
+    digests = set(p.fields.get("build_digest") for p in pubs.entries.values()) if pubs is not None else set()
+    shared_users[config.prefix] = (digests, (id(context.paper_template), icon_images()))
+
+    live = set().union(*(d for d, _ in shared_users.values()))
+    looks = set(look for _, look in shared_users.values())
+    for k in [k for k in entry_store if k not in live]:
+        entry_store.pop(k)
+    for k in [k for k in paper_fragments if k[0] not in live or k[2:] not in looks]:
+        paper_fragments.pop(k)
+
+
+def build_pubs_inner(pubs_index: PubIndex, title: str, full: bool, only: bool = False):
+    if title == "":
+        return
 
     if not only:
-        pubs_html = '<h3 id="%spublications">%s</h3>' % (title, title)
-    else:
-        pubs_html = ""
+        yield '<h3 id="%spublications">%s</h3>' % (title, title)
 
-    pubs_html += pubs_list
+    section = pubs_index.all if full else pubs_index.selected
+    images = icon_images()
+    for p in section.get(title, []):
+        status("- " + p.fields["title"])
 
-    return pubs_html
+        if "build_equal_contribution" in p.fields:
+            equal_contribution = int(p.fields["build_equal_contribution"])
+        else:
+            equal_contribution = 0
 
+        authors = build_authors(p.persons['author'], equal_contribution)
+        yield authors.join(paper_fragments_for(p, images))
 
-def build_pubs(pubs, full: bool):
-    if len(pubs.entries) == 0:
-        return ""
+
+def build_pubs(pubs_index: PubIndex, full: bool, more: str = "pubs.html"):
+    if len(pubs_index.all) == 0:
+        return
 
     status("\nAdding publications:")
 
-    pubs_html = '<div class="section">\n'
+    yield '<div class="section">\n'
 
-    if some_not_selected(pubs) and not full:
-        pubs_html += '<h1>Selected Publications <small style="font-weight: 300; float: right; padding-top: 0.23em">(<a href="./pubs.html">See all publications</a>)</small></h1>'
+    if pubs_index.some_not_selected and not full:
+        yield '<h1>Selected Publications <small style="font-weight: 300; float: right; padding-top: 0.23em">(<a href="./%s">See all publications</a>)</small></h1>' % more
     elif full:
-        link = '<a href="./index.html">%s</a>' % meta_json["name"]
-        pubs_html += (
+        link = '<a href="./index.html">%s</a>' % context.meta_json["name"]
+        yield (
             '<h1>Publications <small style="font-weight: 300; float: right; padding-top: 0.23em">%s</small></h1>\n'
             % link
         )
     else:
-        pubs_html += "<h1>Publications</h1>"
+        yield "<h1>Publications</h1>"
 
-    pubs_html += '<div class="hbar"></div>\n'
-    pubs_html += '<div id="publications">\n'
+    yield '<div class="hbar"></div>\n'
+    yield '<div id="publications">\n'
 
-    titles = get_pub_titles(pubs, full)
+    titles = get_pub_titles(pubs_index, full)
 
     for i in range(len(titles)):
         title = titles[i]
-        pubs_html += build_pubs_inner(pubs, title, full, len(titles) == 1)
+        yield from build_pubs_inner(pubs_index, title, full, len(titles) == 1)
 
-    pubs_html += "</div>\n"  # close pubs
-    pubs_html += "</div>\n"  # close section
-
-    return pubs_html
+    yield "</div>\n"  # close pubs
+    yield "</div>\n"  # close section
 
 
 def build_profile(profile: Dict[str, str]):
     profile_html = '<div class="profile">\n'
-    profile_html += (
-        '<img class="headshot" src="%s" alt="Headshot"/>\n' % profile["headshot"]
-    )
+    profile_html += image_html(profile["headshot"], "headshot", "Headshot") + "\n"
     profile_html += "<p>" + "</p><p>".join(profile["about"].split("\n")) + "</p>"
     if "research" in profile:
         profile_html += "<p>" + "</p><p>".join(profile["research"].split("\n")) + "</p>"
@@ -445,91 +1332,248 @@ def build_profile(profile: Dict[str, str]):
     return profile_html
 
 
-def add_notes(html: str, notes: Dict[str, str]):
+# Auto links and notes
+#
+# Both passes wrap every occurrence of a known name that is not already
+# inside an open tag of the same kind. All names (plus the open/close tags,
+# which let us track nesting) are compiled into one Aho-Corasick automaton,
+# so the page is scanned once no matter how many names there are. Overlaps
+# are resolved the same way the old one-name-at-a-time loop did: longer
+# names win, then earlier names, then earlier positions.
+Matcher = collections.namedtuple("Matcher", ["goto", "fail", "out"])
+matchers = {}
+
+
+def compile_matcher(patterns: List[str]):
+    goto = [{}]
+    out = [[]]
+    for pattern in patterns:
+        state = 0
+        for c in pattern:
+            if c not in goto[state]:
+                goto[state][c] = len(goto)
+                goto.append({})
+                out.append([])
+            state = goto[state][c]
+        out[state].append(pattern)
+
+    fail = [0] * len(goto)
+    queue = collections.deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for c, child in goto[state].items():
+            queue.append(child)
+            f = fail[state]
+            while f and c not in goto[f]:
+                f = fail[f]
+            fail[child] = goto[f].get(c, 0)
+            out[child] = out[child] + out[fail[child]]
+
+    return Matcher(goto, fail, out)
+
+
+def resolve_overlaps(candidates, limit: int):
+    # candidates are (start, rank, name). Groups of overlapping candidates are
+    # resolved on their own, best rank first, then earlier positions. A group
+    # is only final once it ends at or before limit, since a later match could
+    # still overlap it otherwise.
+    candidates.sort()
+    chosen = []
+    i = 0
+    while i < len(candidates):
+        j = i + 1
+        reach = candidates[i][0] + len(candidates[i][2])
+        while j < len(candidates) and candidates[j][0] < reach:
+            reach = max(reach, candidates[j][0] + len(candidates[j][2]))
+            j += 1
+        if reach > limit:
+            break
+        if j == i + 1:
+            chosen.append((candidates[i][0], candidates[i][2]))
+            i = j
+            continue
+
+        group = []
+        for start, _, name in sorted(candidates[i:j], key=lambda c: (c[1], c[0])):
+            end = start + len(name)
+            if all(end <= s or start >= s + len(n) for s, n in group):
+                group.append((start, name))
+        chosen += sorted(group)
+        i = j
+
+    return chosen, candidates[i:]
+
+
+def annotate(fragments, replacements: Dict[str, str], open_tag: str, close_tag: str, template: str):
+    names = sorted([k for k in replacements if k], key=len, reverse=True)
+    if len(names) == 0:
+        yield from fragments
+        return
+
+    key = (tuple(names), open_tag, close_tag)
+    if key not in matchers:
+        matchers[key] = compile_matcher(names + [open_tag, close_tag])
+    goto, fail, out = matchers[key]
+    rank = {name: i for i, name in enumerate(names)}
+    longest = max(len(p) for p in names + [open_tag, close_tag])
+
+    state = 0
+    pos = 0  # characters scanned so far
+    emitted = 0  # characters passed on so far; buffer holds the rest
+    buffer = ""
+    tags = collections.deque()  # (end, nesting after) of recent open/close tags
+    base = 0  # nesting after the tags that fell off the front of tags
+    candidates = []
+
+    for fragment in itertools.chain(fragments, [None]):
+        if fragment is not None:
+            buffer += fragment
+            for c in fragment:
+                while state and c not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(c, 0)
+                pos += 1
+                for found in out[state]:
+                    start = pos - len(found)
+                    if found == open_tag or found == close_tag:
+                        nesting = tags[-1][1] if tags else base
+                        tags.append((pos, nesting + (1 if found == open_tag else -1)))
+                    if found in rank:
+                        nesting = base
+                        for end, after in reversed(tags):
+                            if end <= start:
+                                nesting = after
+                                break
+                        if nesting == 0:
+                            candidates.append((start, rank[found], found))
+
+            # no match found from now on can start before limit
+            limit = pos + 1 - longest
+            while tags and tags[0][0] <= limit:
+                base = tags.popleft()[1]
+        else:
+            limit = pos
+
+        chosen, candidates = resolve_overlaps(candidates, limit)
+        bound = min(limit, candidates[0][0]) if candidates else limit
+        if bound <= emitted:
+            continue
+
+        pieces = []
+        last = emitted
+        for start, name in chosen:
+            status(f"- {name} {start}", 2)
+            pieces.append(buffer[last - emitted : start - emitted])
+            pieces.append(template % (replacements[name], name))
+            last = start + len(name)
+        pieces.append(buffer[last - emitted : bound - emitted])
+        buffer = buffer[bound - emitted :]
+        emitted = bound
+
+        yield "".join(pieces)
+
+
+def stream_notes(fragments, notes: Dict[str, str]):
     status("\nAdding notes:", 2)
 
-    toreplace = sorted(notes.keys(), key=len, reverse=True)
+    return annotate(fragments, notes, "<abbr title=", "</abbr>", '<abbr title="%s">%s</abbr>')
 
-    for name in toreplace:
-        pos = html.find(name)
-        while pos != -1:
-            prefix = html[:pos]
-            suffix = html[pos:]
 
-            open = html[:pos].count("<abbr title=")
-            close = html[:pos].count("</abbr>")
+def stream_links(fragments, links: Dict[str, str]):
+    status("\nAdding links:", 2)
 
-            status(f"- {name} {pos} {open} {close}", 2)
-            target = name + " "
-            if pos >= 0 and open == close:
-                target = '<abbr title="%s">%s</abbr>' % (notes[name], name)
-                suffix = suffix.replace(name, target, 1)
-                html = prefix + suffix
+    return annotate(fragments, links, "<a href=", "</a>", '<a href="%s">%s</a>')
 
-            start = (len(prefix) - len(name)) + len(
-                target
-            )  # we got rid of name and replaced it with target
-            tmp = html[start:].find(name)
-            pos = tmp + start if tmp >= 0 else tmp
 
-    return html
+def add_notes(html: str, notes: Dict[str, str]):
+    return "".join(stream_notes([html], notes))
 
 
 def add_links(html: str, links: Dict[str, str]):
-    status("\nAdding links:", 2)
+    return "".join(stream_links([html], links))
+
+
+def normalize(fragments):
+    # inspect.cleandoc, one line at a time. The second line of a page is always
+    # <html lang="en">, so there is never a common indent to take off.
+    partial = []
+    started = False
+    first = True
+    blank = 0
+    for fragment in itertools.chain(fragments, [None]):
+        if fragment is None:
+            lines = ["".join(partial)]
+        else:
+            lines = fragment.split("\n")
+            if len(lines) == 1:
+                partial.append(fragment)
+                continue
+            lines[0] = "".join(partial) + lines[0]
+            partial = [lines.pop()]
+
+        for line in lines:
+            line = line.expandtabs()
+            if first:
+                line = line.lstrip()
+                first = False
+            if line == "":
+                blank += 1
+            elif not started:
+                started = True
+                blank = 0
+                yield line
+            else:
+                yield "\n" * (blank + 1) + line
+                blank = 0
 
-    toreplace = sorted(links.keys(), key=len, reverse=True)
 
-    for name in toreplace:
-        pos = html.find(name)
-        while pos != -1:
-            prefix = html[:pos]
-            suffix = html[pos:]
+def build_page(content, links: Dict[str, str], notes: Dict[str, str], has_dark: bool):
+    body = itertools.chain(
+        ["<body>\n", header(has_dark), '<div class="content">\n'],
+        content,
+        ["</div>\n", context.footer_html, "</body>\n"],
+    )
 
-            open = html[:pos].count("<a href=")
-            close = html[:pos].count("</a>")
+    body = profiled("add links", stream_links(profiled("render", body), links))
+    page = itertools.chain(
+        ["<!DOCTYPE html>\n", '<html lang="en">\n', context.head_html + "\n\n"],
+        profiled("add notes", stream_notes(body, notes)),
+        ["</html>\n"],
+    )
+
+    return profiled("normalize", normalize(page))
 
-            status(f"- {name} {pos} {open} {close}", 2)
-            target = name + " "
-            if pos >= 0 and open == close:
-                target = '<a href="%s">%s</a>' % (links[name], name)
-                suffix = suffix.replace(name, target, 1)
-                html = prefix + suffix
 
-            start = (len(prefix) - len(name)) + len(
-                target
-            )  # we got rid of name and replaced it with target
-            tmp = html[start:].find(name)
-            pos = tmp + start if tmp >= 0 else tmp
+def build_pages_nav(pages, current: str):
+    if len(pages) <= 1:
+        return
 
-    return html
+    yield '<div class="pages">\n'
+    for page in pages:
+        if page.name == current:
+            yield "<strong>%s</strong>\n" % page.title
+        else:
+            yield '<a href="./%s">%s</a>\n' % (page.name, page.title)
+    yield "</div>\n"
 
 
 def build_index(
     profile_json: Dict[str, str],
     news_json: List[Dict[str, str]],
-    pubs_bibtex,
+    pubs_index: PubIndex,
     links: Dict[str, str],
     notes: Dict[str, str],
     has_dark: bool,
+    news_pages=[],
+    pubs_pages=[],
 ):
-    body_html = "<body>\n"
-    body_html += header(has_dark)
-    body_html += '<div class="content">\n'
-    body_html += build_profile(profile_json)
-    body_html += build_news(news_json, 5, False)
-    body_html += build_pubs(pubs_bibtex, False)
-    body_html += "</div>\n"
-    body_html += footer_html
-    body_html += "</body>\n"
-
-    index_page = "<!DOCTYPE html>\n"
-    index_page += '<html lang="en">\n'
-    index_page += head_html + "\n\n"
-    index_page += add_notes(add_links(body_html, links), notes)
-    index_page += "</html>\n"
+    content = itertools.chain(
+        [build_profile(profile_json)],
+        build_news(news_json, 5, False, news_pages[0].name if news_pages else "news.html"),
+        build_pubs(pubs_index, False, pubs_pages[0].name if pubs_pages else "pubs.html"),
+    )
 
-    return inspect.cleandoc(index_page)
+    return build_page(content, links, notes, has_dark)
 
 
 def build_news_page(
@@ -537,62 +1581,48 @@ def build_news_page(
     links: Dict[str, str],
     notes: Dict[str, str],
     has_dark: bool,
+    pages=[],
+    current: str = "news.html",
+    search: bool = False,
 ):
-    content = build_news(news_json, len(news_json), True)
-
-    if content == "":
+    if len(news_json) == 0:
         return ""
 
-    body_html = "<body>\n"
-    body_html += header(has_dark)
-    body_html += '<div class="content">\n'
-    body_html += content
-    body_html += "</div>\n"
-    body_html += footer_html
-    body_html += "</body>\n"
-
-    news_html = "<!DOCTYPE html>\n"
-    news_html += '<html lang="en">\n'
-    news_html += head_html + "\n\n"
-    news_html += add_notes(add_links(body_html, links), notes)
-    news_html += "</html>\n"
+    content = itertools.chain(
+        [SEARCH_BOX % asset("search.js") if search else ""],
+        build_news(news_json, len(news_json), True),
+        build_pages_nav(pages, current),
+    )
 
-    return inspect.cleandoc(news_html)
+    return build_page(content, links, notes, has_dark)
 
 
 def build_pubs_page(
-    pubs_bibtex,
+    pubs_index: PubIndex,
     links: Dict[str, str],
     notes: Dict[str, str],
     has_dark: bool,
+    pages=[],
+    current: str = "pubs.html",
+    search: bool = False,
 ):
-    content = build_pubs(pubs_bibtex, True)
-
-    if content == "":
+    if len(pubs_index.all) == 0:
         return ""
 
-    body_html = "<body>\n"
-    body_html += header(has_dark)
-    body_html += '<div class="content">\n'
-    body_html += content
-    body_html += "</div>\n"
-    body_html += footer_html
-    body_html += "</body>\n"
-
-    pubs_html = "<!DOCTYPE html>\n"
-    pubs_html += '<html lang="en">\n'
-    pubs_html += head_html + "\n\n"
-    pubs_html += add_notes(add_links(body_html, links), notes)
-    pubs_html += "</html>\n"
+    content = itertools.chain(
+        [SEARCH_BOX % asset("search.js") if search else ""],
+        build_pubs(pubs_index, True),
+        build_pages_nav(pages, current),
+    )
 
-    return inspect.cleandoc(pubs_html)
+    return build_page(content, links, notes, has_dark)
 
 
 def build_cv(
     meta_json: Dict[str, str],
     profile_json: Dict[str, str],
     education_json: Dict[str, str],
-    pubs_bibtex,
+    pubs_index: PubIndex,
     presentations_json: Dict[str, str],
     teaching_json: Dict[str, str],
     work_json: Dict[str, str],
@@ -601,474 +1631,1403 @@ def build_cv(
     volunteer_json: Dict[str, str],
     langugae_json: Dict[str, str],
 ):
-    cv_tex = r"\documentclass{federico_cv}" + "\n"
-    cv_tex += r"\lhead{María Díaz de León Derby}" + "\n"
-    cv_tex += r"\frenchspacing" + "\n"
-    cv_tex += r"\usepackage[backend=biber,style=numeric,refsection=section,maxbibnames=12,minbibnames=11,sorting=ydnt,defernumbers=true,doi=false,isbn=false,url=false,eprint=false]{biblatex}" + "\n"
-    cv_tex += r"\bibliography{cv}" + "\n"
-    cv_tex += r"\begin{document}" + "\n\n\n"
+    yield r"\documentclass{federico_cv}" + "\n"
+    yield r"\lhead{María Díaz de León Derby}" + "\n"
+    yield r"\frenchspacing" + "\n"
+    yield r"\usepackage[backend=biber,style=numeric,refsection=section,maxbibnames=12,minbibnames=11,sorting=ydnt,defernumbers=true,doi=false,isbn=false,url=false,eprint=false]{biblatex}" + "\n"
+    yield r"\bibliography{cv}" + "\n"
+    yield r"\begin{document}" + "\n\n\n"
 
-    cv_tex += f"\contact{{{meta_json['name']}}}\n"
-    cv_tex += f"{{\MYhref{{{profile_json['website']}}}{{{profile_json['website']}}}}}\n"
-    cv_tex += f"{{\MYhref{{mailto:{profile_json['email']}}}{{{profile_json['email']}}}}}\n\n\n"
+    yield f"\contact{{{meta_json['name']}}}\n"
+    yield f"{{\MYhref{{{profile_json['website']}}}{{{profile_json['website']}}}}}\n"
+    yield f"{{\MYhref{{mailto:{profile_json['email']}}}{{{profile_json['email']}}}}}\n\n\n"
 
-    cv_tex += "\section{Research Interests}\n"
-    cv_tex += f"{profile_json['research']}\n\n\n"
+    yield "\section{Research Interests}\n"
+    yield f"{profile_json['research']}\n\n\n"
 
-    cv_tex += r"\begin{tblSection}{Education}{0.1}{0.85}" + "\n"
+    yield r"\begin{tblSection}{Education}{0.1}{0.85}" + "\n"
     for edu in education_json:
-        cv_tex += "\degree\n"
-        cv_tex += f"{{{edu['year']}}}\n"
-        cv_tex += f"{{{edu['institution']}}}\n"
-        cv_tex += f"{{{edu['degree']}}}\n"
-        cv_tex += f"{{{edu['note']}}}\n\n"
-    cv_tex += r"\end{tblSection}" + "\n\n\n"
-
-    cv_tex += r"\let\thefootnote\relax\footnotetext{* denotes equal contribution.}"
-    cv_tex += r"\nocite{*}" + "\n"
-    sections = []
-    for pub in pubs_bibtex.entries.values():
-        sections.append(pub.fields["build_keywords"])
-    sections = sorted(list(set(sections)))
-    for section in sections:
-        cv_tex += f"\printbibliography[keyword={{{section}}},title={{{section}}},resetnumbers=true]\n"
-    cv_tex += "\n\n\n"
-
-    cv_tex += r"\begin{tblSection}{Presentations}{0.1}{0.85}" + "\n"
+        yield "\degree\n"
+        yield f"{{{edu['year']}}}\n"
+        yield f"{{{edu['institution']}}}\n"
+        yield f"{{{edu['degree']}}}\n"
+        yield f"{{{edu['note']}}}\n\n"
+    yield r"\end{tblSection}" + "\n\n\n"
+
+    yield r"\let\thefootnote\relax\footnotetext{* denotes equal contribution.}"
+    yield r"\nocite{*}" + "\n"
+    for section in sorted(pubs_index.all):
+        yield f"\printbibliography[keyword={{{section}}},title={{{section}}},resetnumbers=true]\n"
+    yield "\n\n\n"
+
+    yield r"\begin{tblSection}{Presentations}{0.1}{0.85}" + "\n"
     for presentation in presentations_json:
-        cv_tex += r"\leftbfrightsingle" + "\n"
-        cv_tex += f"{{{presentation['date']}}}\n"
-        cv_tex += f"{{{presentation['venue']}}}\n"
-        cv_tex += f"{{{presentation['category']}: \\textit{{{presentation['title']}}}}}\n\n"
-    cv_tex += r"\end{tblSection}" + "\n\n\n"
+        yield r"\leftbfrightsingle" + "\n"
+        yield f"{{{presentation['date']}}}\n"
+        yield f"{{{presentation['venue']}}}\n"
+        yield f"{{{presentation['category']}: \\textit{{{presentation['title']}}}}}\n\n"
+    yield r"\end{tblSection}" + "\n\n\n"
 
-    cv_tex += r"\begin{tblSection}{Teaching and Mentoring}{0.1}{0.85}" + "\n"
+    yield r"\begin{tblSection}{Teaching and Mentoring}{0.1}{0.85}" + "\n"
     for teaching in teaching_json:
-        cv_tex += r"\leftbfrightsingle" + "\n"
-        cv_tex += f"{{{teaching['date']}}}\n"
-        cv_tex += f"{{{teaching['role']}, {teaching['program']}}}\n"
+        yield r"\leftbfrightsingle" + "\n"
+        yield f"{{{teaching['date']}}}\n"
+        yield f"{{{teaching['role']}, {teaching['program']}}}\n"
         for bullet in teaching['bullets']:
-            cv_tex += f"{{- {bullet}}}\n"
-        cv_tex += "\n"
-    cv_tex += r"\end{tblSection}" + "\n\n\n"
+            yield f"{{- {bullet}}}\n"
+        yield "\n"
+    yield r"\end{tblSection}" + "\n\n\n"
 
-    cv_tex += r"\begin{tblSection}{Industrial Work Experience}{0.1}{0.85}" + "\n"
+    yield r"\begin{tblSection}{Industrial Work Experience}{0.1}{0.85}" + "\n"
     for work in work_json:
-        cv_tex += r"\leftbfrightsingle" + "\n"
-        cv_tex += f"{{{work['date']}}}\n"
-        cv_tex += f"{{{work['role']}, {work['company']}}}\n"
+        yield r"\leftbfrightsingle" + "\n"
+        yield f"{{{work['date']}}}\n"
+        yield f"{{{work['role']}, {work['company']}}}\n"
         for bullet in work['bullets']:
-            cv_tex += f"{{- {bullet}}}\n"
-        cv_tex += "\n"
-    cv_tex += r"\end{tblSection}" + "\n\n\n"
+            yield f"{{- {bullet}}}\n"
+        yield "\n"
+    yield r"\end{tblSection}" + "\n\n\n"
 
-    cv_tex += r"\begin{tblSection}{Service}{0.1}{0.85}" + "\n"
+    yield r"\begin{tblSection}{Service}{0.1}{0.85}" + "\n"
     for service in service_json:
-        cv_tex += r"\leftbfrightsingle" + "\n"
-        cv_tex += f"{{{service['date']}}}\n"
-        cv_tex += f"{{{service['role']}, {service['organization']}}}\n"
+        yield r"\leftbfrightsingle" + "\n"
+        yield f"{{{service['date']}}}\n"
+        yield f"{{{service['role']}, {service['organization']}}}\n"
         for bullet in service['bullets']:
-            cv_tex += f"{{- {bullet}}}\n"
-        cv_tex += "\n"
-    cv_tex += r"\end{tblSection}" + "\n\n\n"
+            yield f"{{- {bullet}}}\n"
+        yield "\n"
+    yield r"\end{tblSection}" + "\n\n\n"
 
-    cv_tex += r"\begin{tblSection}{Awards and Distinctions}{0.1}{0.85}" + "\n"
+    yield r"\begin{tblSection}{Awards and Distinctions}{0.1}{0.85}" + "\n"
     for award in awards_json:
-        cv_tex += r"\award" + "\n"
-        cv_tex += f"{{{award['date']}}}\n"
-        cv_tex += f"{{{award['text']}}}\n\n"
-    cv_tex += r"\end{tblSection}" + "\n\n\n"
+        yield r"\award" + "\n"
+        yield f"{{{award['date']}}}\n"
+        yield f"{{{award['text']}}}\n\n"
+    yield r"\end{tblSection}" + "\n\n\n"
 
-    cv_tex += r"\begin{tblSection}{Volunteer Work}{0.1}{0.85}" + "\n"
+    yield r"\begin{tblSection}{Volunteer Work}{0.1}{0.85}" + "\n"
     for volunteer in volunteer_json:
-        cv_tex += r"\job" + "\n"
-        cv_tex += f"{{{volunteer['date']}}}\n"
-        cv_tex += f"{{{volunteer['title']}}}\n"
+        yield r"\job" + "\n"
+        yield f"{{{volunteer['date']}}}\n"
+        yield f"{{{volunteer['title']}}}\n"
         for bullet in volunteer['bullets']:
-            cv_tex += f"{{- {bullet}}}\n"
-        cv_tex += "\n"
-    cv_tex += r"\end{tblSection}" + "\n\n\n"
+            yield f"{{- {bullet}}}\n"
+        yield "\n"
+    yield r"\end{tblSection}" + "\n\n\n"
 
-    cv_tex += r"\begin{tblSection}{Languages}{0.1}{0.85}" + "\n"
+    yield r"\begin{tblSection}{Languages}{0.1}{0.85}" + "\n"
     for language in langugae_json:
-        cv_tex += r"\leftrightsingletight" + "\n"
-        cv_tex += f"{{{language['language']}}}\n"
+        yield r"\leftrightsingletight" + "\n"
+        yield f"{{{language['language']}}}\n"
         evidence = f" ({language['evidence']})" if language['evidence']  != "" else ""
-        cv_tex += f"{{{language['level']}{evidence}}}\n\n"
-    cv_tex += r"\end{tblSection}" + "\n\n\n"
-
-    cv_tex += r"\end{document}"
-    return cv_tex
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-                prog="./build.py",
-                description="Federico's Academic Website Generator: Builds a website from json files.",
-                epilog="For more information, see README.md.")
+        yield f"{{{language['level']}{evidence}}}\n\n"
+    yield r"\end{tblSection}" + "\n\n\n"
 
-    parser.add_argument('-v', '--verbosity', type=int, default=0, help=f"set the output verbosity (default: 0)")
-    parser.add_argument('-o', '--output', type=str, default="docs", help=f"set the output directory (default: \"docs\")")
-    parser.add_argument('-t', '--templates', type=str, default="templates", help=f"set the templates directory (default: \"templates\")")
-    parser.add_argument('-c', "--curriculum-vitae", action="store_true", help="generate a curriculum vitae in LaTeX too")
-    
-    args = parser.parse_args()
+    yield r"\end{document}"
 
-    config = Config(
-        verbosity=args.verbosity,
-        prefix=os.path.dirname(__file__),
-        target=args.output,
-        templates=args.templates,
-    )
 
-    cleanup()
+# The bibliography for the curriculum vitae is written straight from the
+# loaded entries, which are shared with every other output and so are never
+# changed: authors are rewritten (your name in bold, equal contributions
+# starred) and build_* fields dropped as each entry is written.
+@functools.lru_cache(maxsize=None)
+def bib_writer():
+    from pybtex.database.output.bibtex import Writer
 
-    # Load json files
-    status("Loading json files:")
+    return Writer()
 
-    meta_json = read_data("data/meta.json", optional=False)
-    fail_if_not("name" in meta_json, 'Must include a "name" in data/meta.json!')
-    fail_if_not(
-        "description" in meta_json, 'Must include a "description" in data/meta.json!'
-    )
-    fail_if_not("favicon" in meta_json, 'Must include a "favicon" in data/meta.json!')
-    fill_if_missing(meta_json, "tracker")
 
-    style_json = read_data("data/style.json", optional=False)
-    fail_if_not(
-        "font-color" in style_json, 'Must include a "font-color" in data/style.json!'
-    )
-    fail_if_not(
-        "background-color" in style_json,
-        'Must include a "background-color" in data/style.json!',
-    )
-    fail_if_not(
-        "header-color" in style_json,
-        'Must include a "header-color" in data/style.json!',
-    )
-    fail_if_not(
-        "accent-color" in style_json,
-        'Must include a "accent-color" in data/style.json!',
-    )
-    fail_if_not(
-        "link-hover-color" in style_json,
-        'Must include a "link-hover-color" in data/style.json!',
-    )
-    fail_if_not(
-        "divider-color" in style_json,
-        'Must include a "divider-color" in data/style.json!',
-    )
-    fail_if_not(
-        "paper-img" in style_json, 'Must include a "paper-img" in data/style.json!'
-    )
-    fail_if_not(
-        "extra-img" in style_json, 'Must include a "extra-img" in data/style.json!'
-    )
-    fail_if_not(
-        "slides-img" in style_json, 'Must include a "slides-img" in data/style.json!'
-    )
-    fail_if_not(
-        "bibtex-img" in style_json, 'Must include a "bibtex-img" in data/style.json!'
-    )
+def bib_value(value: str, comments: bool = False):
+    # encoded and quoted the way pybtex writes it, which refuses unmatched braces
+    from pybtex.bibtex.exceptions import BibTeXError
 
-    fill_if_missing(style_json, "font-color-dark", style_json["font-color"])
-    fill_if_missing(style_json, "background-color-dark", style_json["background-color"])
-    fill_if_missing(style_json, "header-color-dark", style_json["header-color"])
-    fill_if_missing(style_json, "accent-color-dark", style_json["accent-color"])
-    fill_if_missing(style_json, "link-hover-color-dark", style_json["link-hover-color"])
-    fill_if_missing(style_json, "divider-color-dark", style_json["divider-color"])
-    fill_if_missing(style_json, "paper-img-dark", style_json["paper-img"])
-    fill_if_missing(style_json, "extra-img-dark", style_json["extra-img"])
-    fill_if_missing(style_json, "slides-img-dark", style_json["slides-img"])
-    fill_if_missing(style_json, "bibtex-img-dark", style_json["bibtex-img"])
-
-    profile_json = read_data("data/profile.json", optional=False)
-    fail_if_not(
-        "headshot" in profile_json,
-        'Must include a "headshot" field in data/profile.json!',
-    )
-    fail_if_not(
-        "about" in profile_json,
-        'Must include a "about" field in data/profile.json!',
-    )
-    fail_if_not("cv" in profile_json, 'Must include a "cv" field in data/profile.json!')
-    fail_if_not(
-        "email" in profile_json, 'Must include a "email" field in data/profile.json!'
-    )
-    fail_if_not(
-        "scholar" in profile_json,
-        'Must include a "scholar" field in data/profile.json!',
-    )
+    writer = bib_writer()
+    value = writer._encode_with_comments(value) if comments else writer._encode(value)
+    try:
+        return writer.quote(value)
+    except BibTeXError as e:
+        error(f"Can't write {config.target}/cv/cv.bib: {e}")
 
-    # These next four can be empty
-    news_json = read_data("data/news.json", optional=True)
-    for news in news_json:
-        fail_if_not(
-            "date" in news,
-            'Must include a "date" field for each news in data/news.json!',
-        )
-        fail_if_not(
-            "text" in news,
-            'Must include a "text" field for each news in data/news.json!',
-        )
 
-    dates = [datetime.strptime(n["date"], "%m/%Y") for n in news_json]
-    warn_if_not(
-        dates == sorted(dates, reverse=True),
-        "The dates in data/news.json are not in order.",
-    )
+def bib_person(person):
+    first = " ".join(person.first_names + person.middle_names)
+    last = " ".join(person.prelast_names + person.last_names)
+    lineage = " ".join(person.lineage_names)
+    return last + (", " + lineage if lineage else "") + (", " + first if first else "")
 
-    pubs_bibtex = parse_file("data/publications.bib") if os.path.exists("data/publications.bib") else []
-    for pub in pubs_bibtex.entries.values():
-        fail_if_not(
-            "year" in pub.fields,
-            'Must include a "year" subfield for each pub venue in data/publications.json!',
-        )
-        fail_if_not(
-            "title" in pub.fields,
-            'Must include a "title" field for each pub in data/publications.json!',
-        )
-        fail_if_not(
-            "journal" in pub.fields or "booktitle" in pub.fields,
-            'Must include a "journal" or "booktitle" field for each pub in data/publications.json!',
-        )
-        fail_if_not(
-            len(pub.persons['author']) > 0,
-            'Must include an "author" field for each pub in data/publications.json!',
-        )
-        fail_if_not(
-            "build_short" in pub.fields,
-            'Must include a "build_short" subfield for each pub venue in data/publications.json!',
-        )
 
-        pub.fields["build_link"] = "" if "build_link" not in pub.fields else pub.fields["build_link"]
-        pub.fields["build_extra"] = "" if "build_extra" not in pub.fields else pub.fields["build_extra"]
-        pub.fields["build_slides"] = "" if "build_slides" not in pub.fields else pub.fields["build_slides"]
-        pub.fields["build_bibtex"] = "" if "build_bibtex" not in pub.fields else pub.fields["build_bibtex"]
+def build_cv_bib(pubs, name: str):
+    if pubs is None:
+        return
 
-        fail_if_not(
-            "build_keywords" in pub.fields,
-            'Must include a "build_keywords" field for each pub in data/publications.json!',
-        )
-        fail_if_not(
-            "build_selected" in pub.fields,
-            'Must include a "build_selected" field for each pub in data/publications.json!',
-        )
+    from pybtex.database import Person
 
-    presentations_json = read_data("data/presentations.json", optional=True)
-    for presentation in presentations_json:
-        fail_if_not(
-            "date" in presentation,
-            'Must include a "date" field for each presentation in data/presentations.json!',
-        )
-        fail_if_not(
-            "title" in presentation,
-            'Must include a "title" field for each presentation in data/presentations.json!',
-        )
-        fail_if_not(
-            "venue" in presentation,
-            'Must include a "venue" field for each presentation in data/presentations.json!',
-        )
-        fail_if_not(
-            "category" in presentation, 
-            'Must include a "category" field for each presentation in data/presentations.json!'
-        )
+    # (AuthorName, starred) -> the author as written
+    cv_authors = {}
 
-    education_json = read_data("data/education.json", optional=True)
-    for education in education_json:
-        fail_if_not(
-            "year" in education,
-            'Must include a "year" field for each education in data/education.json!',
-        )
-        fail_if_not(
-            "degree" in education,
-            'Must include a "degree" field for each education in data/education.json!',
-        )
-        fill_if_missing(education, "note")
-        fail_if_not(
-            "institution" in education,
-            'Must include a "institution" field for each education in data/education.json!',
-        )
+    def cv_author(person, starred: bool):
+        author = author_name(person)
+        if (author, starred) not in cv_authors:
+            written = author.plain + "*" if starred else author.plain
+            written = r"\textbf{" + written + "}" if author.plain == name else written
+            cv_authors[(author, starred)] = bib_person(Person(written))
+        return cv_authors[(author, starred)]
 
-    teaching_json = read_data("data/teaching.json", optional=True)
-    for teaching in teaching_json:
-        fail_if_not(
-            "date" in teaching,
-            'Must include a "date" field for each teaching in data/teaching.json!',
-        )
-        fail_if_not(
-            "program" in teaching,
-            'Must include a "program" field for each teaching in data/teaching.json!',
-        )
-        fail_if_not(
-            "role" in teaching,
-            'Must include a "role" field for each teaching in data/teaching.json!',
-        )
-        fill_if_missing(teaching, "bullets")
+    if pubs.preamble:
+        yield "@preamble{%s}\n\n" % bib_value(pubs.preamble, True)
 
-    work_json = read_data("data/work.json", optional=True)
-    for work in work_json:
-        fail_if_not(
-            "date" in work,
-            'Must include a "date" field for each work in data/work.json!',
-        )
-        fail_if_not(
-            "role" in work,
-            'Must include a "role" field for each work in data/work.json!',
-        )
-        fail_if_not(
-            "company" in work,
-            'Must include a "company" field for each work in data/work.json!',
-        )
-        fill_if_missing(work, "bullets")
+    for i, (key, entry) in enumerate(pubs.entries.items()):
+        equal_contribution = int(entry.fields.get("build_equal_contribution", 0))
+        yield "%s@%s{%s" % ("\n" if i > 0 else "", entry.original_type, key)
+        for role, persons in entry.persons.items():
+            if role == "author":
+                names = [cv_author(a, j < equal_contribution) for j, a in enumerate(persons)]
+            else:
+                names = [bib_person(p) for p in persons]
+            if len(names) > 0:
+                yield ",\n    %s = %s" % (role, bib_value(" and ".join(names)))
 
-    service_json = read_data("data/service.json", optional=True)
-    for service in service_json:
-        fail_if_not(
-            "date" in service,
-            'Must include a "date" field for each service in data/service.json!',
-        )
-        fail_if_not(
-            "role" in service,
-            'Must include a "role" field for each service in data/service.json!',
-        )
-        fail_if_not(
-            "organization" in service,
-            'Must include a "organization" field for each service in data/service.json!',
-        )
-        fill_if_missing(service, "bullets")
+        fields = {f: v for f, v in entry.fields.items() if not f.startswith("build_")}
+        if "build_keywords" in entry.fields:
+            fields["keywords"] = entry.fields["build_keywords"]
+        for field, value in fields.items():
+            yield ",\n    %s = %s" % (field, bib_value(value))
+        yield "\n}\n"
 
-    awards_json = read_data("data/awards.json", optional=True)
-    for award in awards_json:
-        fail_if_not(
-            "date" in award,
-            'Must include a "date" field for each award in data/awards.json!',
-        )
-        fail_if_not(
-            "text" in award,
-            'Must include a "text" field for each award in data/awards.json!',
-        )
 
-    volunteer_json = read_data("data/volunteer.json", optional=True)
-    for volunteer in volunteer_json:
-        fail_if_not(
-            "date" in volunteer,
-            'Must include a "date" field for each volunteer in data/volunteer.json!',
-        )
-        fail_if_not(
-            "title" in volunteer,
-            'Must include a "text" field for each volunteer in data/volunteer.json!',
-        )
-        fill_if_missing(volunteer, "bullets")
+def build(args, incremental: bool):
+    try:
+        todo = build_website(args, incremental)
+    finally:
+        finish_compression()
+
+    if args.curriculum_vitae and args.cv_pdf:
+        compile_cv()
+    return todo
+
+
+def build_website(args, incremental: bool):
+    # nothing is kept from an earlier build, which may have been of another site
+    use_site_context(SiteContext(config))
+
+    outputs = ["index.html", "news.html", "pubs.html", "main.css", "light.css", "dark.css"]
+    if args.fingerprint:
+        shipped = [a for a in SHIPPED_ASSETS if a != "search.js" or args.search]
+        outputs += [a for a in shipped if os.path.exists(os.path.join(config.prefix, config.target, a))]
+    if args.search:
+        outputs += ["search.json"]
+    if args.curriculum_vitae:
+        outputs += ["cv/cv.tex", "cv/cv.bib"]
+
+    with phase("check inputs"):
+        manifest = read_manifest()
+        hash_cache = {}
+        hashes = {o: input_hashes(o, hash_cache) for o in outputs}
+        if args.fingerprint:
+            # pages refer to the assets by their hashes, and turning
+            # --fingerprint on or off changes the name of every asset
+            for o in outputs:
+                for a in [a for a in outputs if a in ASSETS and o.endswith(".html")]:
+                    hashes[o].update(hashes[a])
+                hashes[o]["--fingerprint"] = ""
+        if args.inline_css:
+            # the pages contain the stylesheets
+            for o in [o for o in outputs if o.endswith(".html")]:
+                for a in ["main.css", "light.css", "dark.css"]:
+                    hashes[o].update(input_hashes(a, hash_cache))
+                hashes[o]["--inline-css"] = ""
+        if args.optimize_images:
+            # the pages contain the sizes of the images and the names of their copies
+            for o in [o for o in outputs if o.endswith(".html")]:
+                hashes[o].update(image_inputs(hash_cache))
+                hashes[o]["--optimize-images"] = ""
+        if args.search:
+            # the search box
+            for o in ["news.html", "pubs.html"]:
+                hashes[o]["--search"] = ""
+        if args.compress:
+            # turning --compress off removes the compressed files
+            for o in [o for o in outputs if o.endswith(COMPRESSIBLE)]:
+                hashes[o]["--compress"] = ""
+
+        if incremental:
+            todo = [o for o in outputs if is_stale(o, manifest, hashes[o])]
+            for o in outputs:
+                if o not in todo:
+                    status(f"- {o} is up to date")
+            if len(todo) == 0:
+                success(f"Nothing changed since the last build of {config.target}!")
+                return []
+        else:
+            todo = outputs
 
-    languages_json = read_data("data/languages.json", optional=True)
-    for language in languages_json:
-        fail_if_not(
-            "language" in language,
-            'Must include a "language" field for each language in data/languages.json!',
-        )
-        fail_if_not(
-            "level" in language,
-            'Must include a "level" field for each language in data/languages.json!',
+    # Load json files
+    with phase("validate data"):
+        status("Loading json files:")
+
+        data, errors = validate_data(list(SCHEMAS))
+        pubs_path = os.path.join(config.prefix, "data/publications.bib")
+        needs_pubs = any("data/publications.bib" in OUTPUT_INPUTS[o] for o in todo)
+        with phase("read data/publications.bib"):
+            pubs_bibtex = read_pubs(pubs_path, errors) if needs_pubs else None
+        fail_if_any(errors)
+
+        meta_json, style_json, profile_json = data["data/meta.json"], data["data/style.json"], data["data/profile.json"]
+        news_json, presentations_json = data["data/news.json"], data["data/presentations.json"]
+        education_json, teaching_json, work_json = data["data/education.json"], data["data/teaching.json"], data["data/work.json"]
+        service_json, awards_json = data["data/service.json"], data["data/awards.json"]
+        volunteer_json, languages_json = data["data/volunteer.json"], data["data/languages.json"]
+        auto_links_json, auto_notes_json = data["data/auto_links.json"], data["data/auto_notes.json"]
+        context.meta_json, context.style_json, context.auto_links_json = meta_json, style_json, auto_links_json
+
+        from datetime import datetime
+
+        dates = [datetime.strptime(n["date"], "%m/%Y") for n in news_json]
+        warn_if_not(
+            dates == sorted(dates, reverse=True),
+            "The dates in data/news.json are not in order.",
         )
-        fill_if_missing(language, "evidence")
-
-    auto_links_json = read_data("data/auto_links.json", optional=True)
-    auto_notes_json = read_data("data/auto_notes.json", optional=True)
 
     # Sanity checks
-    if not is_federicos(meta_json["name"]):
-        status("\nPerforming sanity checks:")
-        check_cname()
-        check_tracker(meta_json["tracker"])
+    with phase("sanity checks"):
+        if not is_federicos(meta_json["name"]):
+            status("\nPerforming sanity checks:")
+            check_cname()
+            check_tracker(meta_json["tracker"])
 
     # Load templates
-    status("\nLoading template files:")
-    main_css = read_template(f"{config.templates}/main.css", optional=False)
-    light_css = read_template(f"{config.templates}/light.css", optional=False)
-    dark_css = read_template(f"{config.templates}/dark.css", optional=True)
-    dark_css = light_css if dark_css == "" else dark_css
-    has_dark = light_css != dark_css
-    head_html = read_template(f"{config.templates}/head.html", optional=False)
-    footer_html = read_template(f"{config.templates}/footer.html", optional=False)
-    paper_html = read_template(f"{config.templates}/paper.html", optional=False)
-    news_item_html = read_template(f"{config.templates}/news-item.html", optional=False)
-
-    if is_federicos(meta_json["name"]):
-        footer_html = """\n<footer>\n<p>Feel free to <a href="https://github.com/FedericoAureliano/FedericoAureliano.github.io">use this website template</a>.</p>\n</footer>\n"""
-    else:
-        footer_html = "\n" + footer_html
-
-    # Create HTML and CSS
-    head_html = replace_placeholders(head_html, meta_json)
-    footer_html = replace_placeholders(footer_html, meta_json)
-    main_css = replace_placeholders(main_css, style_json)
-    light_css = replace_placeholders(light_css, style_json)
-    dark_css = replace_placeholders(dark_css, style_json)
-    news_page = build_news_page(news_json, auto_links_json, auto_notes_json, has_dark)
-    pubs_page = build_pubs_page(pubs_bibtex, auto_links_json, auto_notes_json, has_dark)
-    index_page = build_index(
-        profile_json, news_json, pubs_bibtex, auto_links_json, auto_notes_json, has_dark
-    )
+    with phase("compile templates"):
+        status("\nLoading template files:")
+        main_css = read_template(f"{config.templates}/main.css", optional=False)
+        light_css = read_template(f"{config.templates}/light.css", optional=False)
+        dark_css = read_template(f"{config.templates}/dark.css", optional=True)
+        dark_css = light_css if dark_css == "" else dark_css
+        has_dark = light_css != dark_css
+        head_html = read_template(f"{config.templates}/head.html", optional=False)
+        footer_html = read_template(f"{config.templates}/footer.html", optional=False)
+        paper_path = f"{config.templates}/paper.html"
+        paper_template = compile_template(read_template(paper_path, optional=False), PAPER_SLOTS, paper_path, True)
+        news_item_path = f"{config.templates}/news-item.html"
+        news_item_template = compile_template(read_template(news_item_path, optional=False), NEWS_ITEM_SLOTS, news_item_path, True)
+
+        if is_federicos(meta_json["name"]):
+            footer_html = """\n<footer>\n<p>Feel free to <a href="https://github.com/FedericoAureliano/FedericoAureliano.github.io">use this website template</a>.</p>\n</footer>\n"""
+        else:
+            footer_html = "\n" + footer_html
+
+        # Create HTML and CSS
+        theme = theme_css(light_css, dark_css, style_json) if args.inline_css else None
+        warn_if_not(
+            theme is not None or not args.inline_css,
+            f"Can't inline {config.templates}/light.css and dark.css because they have nested blocks.",
+        )
+        head_html = replace_placeholders(head_html, meta_json, f"{config.templates}/head.html")
+        footer_html = replace_placeholders(footer_html, meta_json, f"{config.templates}/footer.html")
+        main_css = replace_placeholders(main_css, style_json, f"{config.templates}/main.css")
+        light_css = replace_placeholders(light_css, style_json, f"{config.templates}/light.css")
+        dark_css = replace_placeholders(dark_css, style_json, f"{config.templates}/dark.css")
+
+        context.inline_theme = theme is not None
+        if context.inline_theme:
+            head_html = inline_styles(head_html, main_css + "\n" + theme, has_dark)
+        context.head_html, context.footer_html = head_html, footer_html
+        context.paper_template, context.news_item_template = paper_template, news_item_template
+
+    assets = {}
+    if args.fingerprint:
+        with phase("fingerprint assets"):
+            sources = {"main.css": main_css, "light.css": light_css, "dark.css": dark_css}
+            for a in [a for a in SHIPPED_ASSETS if a in outputs]:
+                sources[a] = read_template(f"{config.target}/{a}", optional=False)
+            assets = fingerprint_assets(sources)
+            main_css, light_css, dark_css = assets["main.css"], assets["light.css"], assets["dark.css"]
+            context.head_html = rewrite_references(head_html)
+
+    variants = None
+    if args.optimize_images and any(o.endswith(".html") for o in todo):
+        with phase("optimize images"):
+            variants = optimize_images(style_json, profile_json)
+
+    with phase("index publications"):
+        if needs_pubs:
+            forget_shared(pubs_bibtex)
+        pubs_index = index_pubs(pubs_bibtex)
+        pages = {
+            "news.html": shard_news(news_json, meta_json["news-pages"]),
+            "pubs.html": shard_pubs(pubs_index, meta_json["pubs-pages"]),
+        }
+
+    site = {
+        "meta_json": meta_json,
+        "profile_json": profile_json,
+        "news_json": news_json,
+        "pubs_index": pubs_index,
+        "pubs_bibtex": pubs_bibtex,
+        "presentations_json": presentations_json,
+        "education_json": education_json,
+        "teaching_json": teaching_json,
+        "work_json": work_json,
+        "service_json": service_json,
+        "awards_json": awards_json,
+        "volunteer_json": volunteer_json,
+        "languages_json": languages_json,
+        "auto_links_json": auto_links_json,
+        "auto_notes_json": auto_notes_json,
+        "has_dark": has_dark,
+        "main_css": main_css,
+        "light_css": light_css,
+        "dark_css": dark_css,
+        "assets": assets,
+        "search": args.search,
+        "pages": pages,
+        "shards": {s.name: s for family in pages for s in pages[family]},
+    }
+
+    # Sharded pages whose items didn't change are left alone
+    rendered = []
+    records = {}
+    for o in [o for o in OUTPUT_BUILDERS if o in todo]:
+        if o in context.asset_names:
+            rendered.append((o, context.asset_names[o]))
+            records[context.asset_names[o]] = {"inputs": hashes[o], "family": o}
+        elif o not in SHARDED:
+            rendered.append((o, o))
+            records[o] = {"inputs": hashes[o]}
+
+        for s in pages.get(o, []):
+            records[s.name] = {"inputs": hashes[o], "family": o, "items": shard_digest(pages[o], s)}
+            path = os.path.join(config.prefix, config.target, s.name)
+            previous = manifest.get(s.name, {})
+            others = lambda inputs: {i: h for i, h in inputs.items() if i != SHARD_SOURCES[o]}
+            if (not incremental or previous.get("items") != records[s.name]["items"] or not os.path.exists(path)
+                    or others(previous.get("inputs", {})) != others(hashes[o])):
+                rendered.append((o, s.name))
+            else:
+                status(f"- {s.name} is up to date")
+                manifest[s.name] = dict(previous, **records[s.name])
+
+        # remove pages that an earlier build split things into, and old assets
+        for name, record in list(manifest.items()):
+            if record.get("family", name) == o and name not in records:
+                write_file(f"{config.target}/{name}", "")
+                manifest.pop(name)
+
+    # image copies are only kept while the pages still point at them
+    if variants is not None or (not args.optimize_images and any(o.endswith(".html") for o in todo)):
+        for name, record in list(manifest.items()):
+            if record.get("family") == "images" and name not in (variants or []):
+                write_file(f"{config.target}/{name}", "")
+                manifest.pop(name)
+        for name in variants or []:
+            manifest[name] = {"inputs": {}, "family": "images", "written": True}
+
+    # the search index is only written with --search
+    if "search.json" in manifest and "search.json" not in outputs:
+        write_file(f"{config.target}/search.json", "")
+        manifest.pop("search.json")
+
+    # shipped assets are only written with --fingerprint
+    for name, record in list(manifest.items()):
+        if record.get("family") in SHIPPED_ASSETS and record["family"] not in outputs:
+            write_file(f"{config.target}/{name}", "")
+            manifest.pop(name)
 
     # Write to files
     status("\nWriting website:")
-    write_file(f"{config.target}/index.html", index_page)
-    write_file(f"{config.target}/news.html", news_page)
-    write_file(f"{config.target}/pubs.html", pubs_page)
-    write_file(f"{config.target}/main.css", main_css)
-    write_file(f"{config.target}/light.css", light_css)
-    write_file(f"{config.target}/dark.css", dark_css)
+    compressed = {o: r.get("compressed") for o, r in manifest.items()}
+    for o, contents in render_outputs(rendered, site, args.jobs):
+        if args.compress and not isinstance(contents, str):
+            # pages may be streamed, but compressing needs them whole
+            contents = "".join(contents)
+        with phase(f"build {o}"):
+            write_file(f"{config.target}/{o}", contents)
+        manifest[o] = dict(records[o], written=contents != "")
+        if o.endswith(COMPRESSIBLE) and contents != "":
+            if args.compress:
+                manifest[o]["compressed"] = compress_later(f"{config.target}/{o}", contents, compressed.get(o))
+            else:
+                for e in [".gz", ".br"]:
+                    write_file(f"{config.target}/{o}{e}", "")
+    write_manifest(manifest)
 
     # Got to here means everything went well
     success(f"Open {config.target}/index.html in your browser to see your website!")
 
-    if not args.curriculum_vitae:
-        exit(0)
-    
-    status("Generating Curriculum Vitae Latex:")
-    cv = build_cv(meta_json, profile_json, education_json, pubs_bibtex, presentations_json, teaching_json, work_json, service_json, awards_json, volunteer_json, languages_json)
-    write_file(f"{config.target}/cv/cv.tex", cv)
+    if args.curriculum_vitae:
+        success(f"Navigate to {config.target}/cv and do `make view` to see your curriculum vitae!")
+    return todo
+
+
+# Sharding
+#
+# news.html and pubs.html can be split into several pages with "news-pages"
+# and "pubs-pages" in data/meta.json: a number of items per page, "year", or
+# (for publications) "keyword". The first page keeps the name of the family,
+# so links to news.html and pubs.html still work, and the others are named
+# after their number, year, or keyword. Each page is an output of its own,
+# and the manifest records a hash of the items on it, so when only the items
+# changed an incremental build only rewrites the pages whose items changed.
+SHARDED = ["news.html", "pubs.html"]
+# where the items of each sharded output come from
+SHARD_SOURCES = {"news.html": "data/news.json", "pubs.html": "data/publications.bib"}
+
+Shard = collections.namedtuple("Shard", ["name", "title", "items"])
+
+
+def slug(text: str):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+
+def shard(family: str, items: list, setting, group, newest_first: bool):
+    base = family[: -len(".html")]
+
+    if len(items) == 0 or setting == "":
+        return [Shard(family, "", items)]
 
-    # make the your name bold in cv
-    for key in list(pubs_bibtex.entries.keys()):
-        authors = pubs_bibtex.entries[key].persons["author"]
+    if isinstance(setting, int):
+        shards = []
+        for start in range(0, len(items), setting):
+            number = start // setting + 1
+            name = family if number == 1 else f"{base}-{number}.html"
+            shards.append(Shard(name, str(number), items[start : start + setting]))
+        return shards
 
-        if "build_equal_contribution" in pubs_bibtex.entries[key].fields:
-            equal_contribution = int(pubs_bibtex.entries[key].fields["build_equal_contribution"])
+    groups = {}
+    for item in items:
+        groups.setdefault(group(item), []).append(item)
+
+    shards = []
+    names = set([family])
+    for g in sorted(groups, reverse=newest_first):
+        name = family
+        if len(shards) > 0:
+            # keywords like "C" and "C++" have the same slug, and some have none
+            stem = f"{base}-{slug(g) or 'other'}"
+            name, n = f"{stem}.html", 1
+            while name in names:
+                n += 1
+                name = f"{stem}-{n}.html"
+            names.add(name)
+        shards.append(Shard(name, g, groups[g]))
+    return shards
+
+
+def shard_news(news_json: List[Dict[str, str]], setting):
+    return shard("news.html", news_json, setting, lambda n: n["date"][-4:], True)
+
+
+def shard_pubs(pubs_index: PubIndex, setting):
+    ordered = [p for title in sorted(pubs_index.all) for p in pubs_index.all[title]]
+    group = lambda p: p.fields["year"] if setting == "year" else p.fields["build_keywords"]
+
+    shards = shard("pubs.html", ordered, setting, group, setting == "year")
+    return [Shard(s.name, s.title, index_entries(s.items)) for s in shards]
+
+
+def shard_digest(pages, current: Shard):
+    contents = [[(p.name, p.title) for p in pages]]
+    if isinstance(current.items, PubIndex):
+        for title in sorted(current.items.all):
+            contents += [(p.key, repr(p)) for p in current.items.all[title]]
+    else:
+        contents += current.items
+
+    return hashlib.sha256(repr(contents).encode("utf-8")).hexdigest()
+
+
+# Search
+#
+# With --search, the news and publications pages get a search box, and the
+# build writes search.json: one short record per publication and news item
+# (the page it is on, a title, and a detail line) and an inverted index from
+# words to the records that contain them, each list stored as the gaps
+# between record numbers. search.js downloads it the first time someone
+# types, so the pages themselves don't grow. Records are kept by entry, and
+# saved in .cache/ between builds, so a rebuild only tokenizes the entries
+# that changed. Publications are kept by the hash the entry store gives them.
+SEARCH_BOX = """<div class="search">
+<input type="search" id="search" placeholder="Search publications and news" aria-label="Search" data-index="search.json" autocomplete="off">
+<ol id="search-results"></ol>
+</div>
+<script src="%s" defer></script>
+"""
+
+SEARCH_CACHE = "search.pickle"
+
+# ("pub", entry hash, venue) or ("news", date, text) -> (title, detail, words)
+search_records = {}
+
+
+def plain_text(text: str):
+    # without HTML tags, LaTeX commands, or braces
+    text = re.sub(r"\\[a-zA-Z]+\s*|\\.|[{}]", "", re.sub(r"<[^>]*>", " ", text))
+    return " ".join(text.split())
+
+
+def search_words(text: str):
+    import unicodedata
+
+    text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def pub_record(p):
+    # entries that were parsed on their own have no hash
+    key = ("pub", p.fields.get("build_digest") or repr(p), p.fields["build_short"])
+    if key not in search_records:
+        title = plain_text(p.fields["title"])
+        authors = ", ".join(plain_text(author_name(a).full) for a in p.persons["author"])
+        venue = p.fields["build_short"] + " " + p.fields["year"]
+        search_records[key] = (title, authors + " \u00b7 " + venue, search_words(" ".join([title, authors, venue])))
+
+    return key
+
+
+def news_record(n: Dict[str, str]):
+    key = ("news", n["date"], n["text"])
+    if key not in search_records:
+        text = plain_text(n["text"])
+        search_records[key] = (n["date"], text, search_words(n["date"] + " " + text))
+
+    return key
+
+
+def build_search(pages):
+    import pickle
+
+    version = hash_file(__file__)
+    cache_path = os.path.join(config.prefix, CACHE_DIR, SEARCH_CACHE)
+    try:
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)
+        if cache["version"] == version:
+            for key, record in cache["records"].items():
+                search_records.setdefault(key, record)
+    except Exception as _:
+        pass
+
+    keys = []
+    for s in pages["pubs.html"]:
+        keys += [(s.name, pub_record(p)) for title in sorted(s.items.all) for p in s.items.all[title]]
+    for s in pages["news.html"]:
+        keys += [(s.name, news_record(n)) for n in s.items]
+
+    # forget entries that are gone, for long-running builds
+    used = set(k for _, k in keys)
+    for k in [k for k in search_records if k not in used]:
+        search_records.pop(k)
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "wb") as f:
+            pickle.dump({"version": version, "records": search_records}, f, pickle.HIGHEST_PROTOCOL)
+    except Exception as _:
+        status(f"- couldn't write {cache_path}---continuing without it")
+
+    docs = []
+    terms = {}
+    for i, (page, key) in enumerate(keys):
+        title, detail, words = search_records[key]
+        docs.append([page, title, detail])
+        for w in words:
+            postings = terms.setdefault(w, [])
+            if len(postings) == 0 or postings[-1] != i:
+                postings.append(i)
+
+    for w, postings in terms.items():
+        terms[w] = [postings[0]] + [b - a for a, b in zip(postings, postings[1:])]
+
+    return json.dumps({"docs": docs, "terms": terms}, separators=(",", ":"), ensure_ascii=False, sort_keys=True)
+
+
+# Assets
+#
+# With --fingerprint, the stylesheets and scripts are minified and written
+# under names that include a hash of their contents, like main.1a2b3c4d.css,
+# and every reference to them is rewritten. A page can then never pick up a
+# stale stylesheet, and the assets can be served with immutable caching.
+# The scripts and reset.css are shipped in the output directory as they are.
+SHIPPED_ASSETS = ["reset.css", "scroller.js", "mode.js", "search.js"]
+ASSETS = ["main.css", "light.css", "dark.css"] + SHIPPED_ASSETS
+
+
+def asset(name: str):
+    return context.asset_names.get(name, name)
+
+
+@functools.lru_cache(maxsize=None)
+def minify_css(css: str):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    css = re.sub(r"\s+", " ", css)
+    # spaces around + and - matter inside calc(), so leave those alone
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip() + "\n"
+
+
+@functools.lru_cache(maxsize=None)
+def minify_js(js: str):
+    # only what is safe without parsing: indentation, blank lines, and comment lines
+    lines = [line.strip() for line in js.splitlines()]
+    return "\n".join(line for line in lines if line != "" and not line.startswith("//")) + "\n"
+
+
+def rewrite_references(text: str):
+    # quoted names of assets, as in href="main.css" or theme.href = "dark.css"
+    if len(context.asset_names) == 0:
+        return text
+    names = "|".join(re.escape(name) for name in context.asset_names)
+    return re.sub(r"([\"'])(%s)\1" % names, lambda m: m.group(1) + asset(m.group(2)) + m.group(1), text)
+
+
+def fingerprint_assets(sources: Dict[str, str]):
+    # stylesheets first, since the scripts may refer to them
+    assets = {}
+    for name in sorted(sources, key=lambda n: n.endswith(".js")):
+        if name.endswith(".css"):
+            assets[name] = minify_css(sources[name])
         else:
-            equal_contribution = 0
+            assets[name] = minify_js(rewrite_references(sources[name]))
+        base, extension = os.path.splitext(name)
+        digest = hashlib.sha256(assets[name].encode("utf-8")).hexdigest()[:8]
+        context.asset_names[name] = f"{base}.{digest}{extension}"
 
-        for i in range(len(authors)):
-            first = " ".join(authors[i].first_names) + " "
-            middle = " ".join(authors[i].middle_names) + " " if len(authors[i].middle_names) > 0 else ""
-            last = " ".join(authors[i].last_names)
-            author = first + middle + last
-            author = author.replace("{", "").replace("}", "")
+    return assets
 
-            if i < equal_contribution:
-                author_to_write = author + "*"
-            else:
-                author_to_write = author
 
-            if author == meta_json["name"]:
-                authors[i] = Person(r"\textbf{" + str(author_to_write) + "}")
-            else:
-                authors[i] = Person(str(author_to_write))
-                
-        pubs_bibtex.entries[key].persons["author"] = authors
+# Inline styles
+#
+# With --inline-css, main.css and the theme go into a <style> in every page
+# instead of two more blocking requests, and scripts are deferred. Both
+# themes become one stylesheet: colours from data/style.json are CSS custom
+# properties on :root, :root.dark swaps in the dark ones, and rules that only
+# one theme has are scoped to it. The mode switch just toggles that class.
 
-    # remove all the entries in pubs_bibtex that start with build_
-    for key in list(pubs_bibtex.entries.keys()):
-        for field in list(pubs_bibtex.entries[key].fields.keys()):
-            if field == "build_keywords":
-                pubs_bibtex.entries[key].fields["keywords"] = pubs_bibtex.entries[key].fields["build_keywords"]
-                pubs_bibtex.entries[key].fields.pop(field)
-            elif field.startswith("build_"):
-                pubs_bibtex.entries[key].fields.pop(field)
+THEME_SCRIPT = """<script>if (window.matchMedia && window.matchMedia("(prefers-color-scheme: dark)").matches) document.documentElement.classList.add("dark");</script>
+"""
 
-    pubs_bibtex.to_file(f"{config.target}/cv/cv.bib")
 
+@functools.lru_cache(maxsize=None)
+def css_rules(css: str):
+    # (selectors, declarations) pairs, or None if there are nested blocks
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    rule = r"([^{}]+)\{([^{}]*)\}"
+    if re.sub(rule, "", css).strip() != "":
+        return None
 
-    # Got to here means everything went well
-    success(f"Navigate to {config.target}/cv and do `make view` to see your curriculum vitae!")
+    return [(" ".join(m.group(1).split()), " ".join(m.group(2).split())) for m in re.finditer(rule, css)]
+
+
+def theme_css(light: str, dark: str, style: Dict[str, str]):
+    light_template = compile_template(light, list(style.keys()), f"{config.templates}/light.css")
+    dark_template = compile_template(dark, list(style.keys()), f"{config.templates}/dark.css")
+    used = set(name for _, name in light_template.slots + dark_template.slots)
+
+    # accent-color and accent-color-dark both become var(--accent-color)
+    names = {k: k[: -len("-dark")] if k.endswith("-dark") and k[: -len("-dark")] in style else k for k in style}
+    variables = {k: f"var(--{names[k]})" for k in style}
+    light_rules = css_rules(render(light_template, variables))
+    dark_rules = css_rules(render(dark_template, variables))
+    if light_rules is None or dark_rules is None:
+        return None
+
+    light_values = {names[k]: style[k] for k in used if names[k] == k}
+    dark_values = {names[k]: style[k] for k in used if names[k] != k}
+    css = ":root {%s}\n" % "".join(f"--{k}: {v};" for k, v in sorted(light_values.items()))
+    css += ":root.dark {%s}\n" % "".join(f"--{k}: {v};" for k, v in sorted({**light_values, **dark_values}.items()))
+
+    def scoped(selectors, scope):
+        return ", ".join(f"{scope} {selector.strip()}" for selector in selectors.split(","))
+
+    for selectors, declarations in light_rules:
+        selectors = selectors if (selectors, declarations) in dark_rules else scoped(selectors, ":root:not(.dark)")
+        css += f"{selectors} {{{declarations}}}\n"
+    for selectors, declarations in dark_rules:
+        if (selectors, declarations) not in light_rules:
+            css += f"{scoped(selectors, ':root.dark')} {{{declarations}}}\n"
+
+    return css
+
+
+def inline_styles(head: str, css: str, has_dark: bool):
+    style = "<style>%s</style>" % re.sub(r'@charset\s+"[^"]*";', "", minify_css(css)).strip()
+    stylesheet = r'<link\b[^>]*\bhref="%s"[^>]*>'
+    if re.search(stylesheet % "main\\.css", head):
+        head = re.sub(stylesheet % "main\\.css", lambda _: style, head, count=1)
+    else:
+        head = head.replace("</head>", style + "\n</head>", 1)
+    head = re.sub(r"[ \t]*" + stylesheet % "light\\.css" + r"[ \t]*\n?", "", head)
+
+    # scripts from files don't need to block the page
+    head = re.sub(r"<script\b(?![^>]*\bdefer\b)([^>]*\bsrc=[^>]*)>", r"<script\1 defer>", head)
+    if has_dark:
+        head = head.replace("<head>", "<head>\n    " + THEME_SCRIPT.strip(), 1)
+
+    return head
+
+
+# Curriculum vitae PDF
+#
+# With --cv-pdf, cv/cv.tex is compiled to cv/cv.pdf in cv/build/, which is
+# kept between builds. cv/build/state.json remembers the hashes of the
+# sources and of the citations (cv.bcf) and bibliography (cv.bbl) that the
+# last run used, so biber only runs when the .bib or the citations changed,
+# xelatex only runs again while cv.aux keeps changing, and nothing runs when
+# nothing changed.
+CV_SOURCES = ["cv.tex", "cv.bib", "federico_cv.cls"]
+CV_STATE = "build/state.json"
+XELATEX = ["xelatex", "-shell-escape", "-halt-on-error", "-interaction=nonstopmode", "-output-directory", "build", "cv"]
+# xelatex runs after which cv.aux is assumed to never settle
+XELATEX_RUNS = 5
+
+
+def run_tex(command: List[str], cwd: str, log: str):
+    import subprocess
+
+    status(f"- running {' '.join(command)}")
+    try:
+        result = subprocess.run(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:
+        error(f"Couldn't run {command[0]} to compile the curriculum vitae: {e}")
+    fail_if_not(result.returncode == 0, f"{command[0]} failed on the curriculum vitae; see {os.path.join(cwd, log)}")
+
+
+def compile_cv():
+    cv = os.path.join(config.prefix, config.target, "cv")
+    build_path = lambda name: os.path.join(cv, "build", name)
+    try:
+        with open(os.path.join(cv, CV_STATE)) as f:
+            state = json.load(f)
+    except Exception as _:
+        state = {}
+
+    sources = {s: hash_file(os.path.join(cv, s)) for s in CV_SOURCES}
+    previous = state.get("sources", {})
+    if previous == sources and os.path.exists(build_path("cv.pdf")):
+        status(f"- {cv}/cv.pdf is up to date")
+        return
+
+    status("Compiling Curriculum Vitae:")
+    os.makedirs(os.path.join(cv, "build"), exist_ok=True)
+    # don't trust the state if a run fails halfway
+    if os.path.exists(os.path.join(cv, CV_STATE)):
+        os.remove(os.path.join(cv, CV_STATE))
+
+    runs = 0
+    stale = not os.path.exists(build_path("cv.pdf")) or not os.path.exists(build_path("cv.bcf"))
+    if stale or any(previous.get(s) != sources[s] for s in ["cv.tex", "federico_cv.cls"]):
+        before = hash_file(build_path("cv.aux"))
+        run_tex(XELATEX, cv, "build/cv.log")
+        runs += 1
+        again = hash_file(build_path("cv.aux")) != before
+    else:
+        again = False
+
+    # biber reads the citations from cv.bcf, which xelatex writes
+    bcf = hash_file(build_path("cv.bcf"))
+    if previous.get("cv.bib") != sources["cv.bib"] or state.get("cv.bcf") != bcf or not os.path.exists(build_path("cv.bbl")):
+        run_tex(["biber", "build/cv"], cv, "build/cv.blg")
+    bbl = hash_file(build_path("cv.bbl"))
+    again = again or state.get("cv.bbl") != bbl
+
+    while again and runs < XELATEX_RUNS:
+        before = hash_file(build_path("cv.aux"))
+        run_tex(XELATEX, cv, "build/cv.log")
+        runs += 1
+        again = hash_file(build_path("cv.aux")) != before
+
+    if not os.path.exists(os.path.join(cv, "cv.pdf")) or not filecmp.cmp(build_path("cv.pdf"), os.path.join(cv, "cv.pdf"), shallow=False):
+        import shutil
+
+        status(f"- writing {cv}/cv.pdf")
+        shutil.copyfile(build_path("cv.pdf"), os.path.join(cv, "cv.pdf.tmp"))
+        os.replace(os.path.join(cv, "cv.pdf.tmp"), os.path.join(cv, "cv.pdf"))
+
+    write_file(f"{config.target}/cv/{CV_STATE}", json.dumps({"sources": sources, "cv.bcf": bcf, "cv.bbl": bbl}, indent=4))
+    success(f"Compiled {cv}/cv.pdf with {runs} xelatex run{'s' if runs != 1 else ''}")
+
+
+# Compression
+#
+# With --compress, every page, stylesheet, script, bibliography, and JSON or
+# SVG file also gets a .gz sibling (and a .br one, if the brotli package is
+# installed) for servers that send precompressed files. Compressing happens on
+# threads while the remaining pages render, and what they wrote is reported
+# at the end, sorted by name. The manifest remembers the hash of what was
+# compressed, so unchanged files aren't compressed again.
+COMPRESSIBLE = (".html", ".css", ".js", ".bib", ".json", ".svg")
+
+compression_pool = None
+compressions = []
+
+
+@functools.lru_cache(maxsize=None)
+def compressors():
+    # (extension, function) for each format we can write, at maximum compression
+    import gzip
+
+    formats = [(".gz", lambda data: gzip.compress(data, 9, mtime=0))]
+    try:
+        import brotli
+    except ImportError:
+        status("- brotli isn't installed, so only writing .gz files", 0)
+        return formats
+
+    return formats + [(".br", lambda data: brotli.compress(data, quality=11))]
+
+
+def compress_file(path: str, data: bytes):
+    # runs on a worker thread, so it leaves printing to finish_compression
+    written = []
+    for extension, compress in compressors():
+        with open(path + extension + ".tmp", "wb") as f:
+            f.write(compress(data))
+        os.replace(path + extension + ".tmp", path + extension)
+        written.append(path + extension)
+    return written
+
+
+def compress_later(file_name: str, contents: str, previous):
+    # returns the hash to record in the manifest
+    global compression_pool
+
+    data = contents.encode()
+    digest = hashlib.sha256(data).hexdigest()
+    path = os.path.join(config.prefix, file_name)
+    if previous == digest and all(os.path.exists(path + e) for e, _ in compressors()):
+        status(f"- {path} is already compressed")
+        return digest
+
+    if compression_pool is None:
+        import concurrent.futures
+
+        compression_pool = concurrent.futures.ThreadPoolExecutor(os.cpu_count())
+    compressions.append((path, compression_pool.submit(compress_file, path, data)))
+    return digest
+
+
+def finish_compression():
+    global compression_pool
+
+    for path, future in sorted(compressions, key=lambda c: c[0]):
+        try:
+            for written in future.result():
+                status(f"- writing {written}")
+        except Exception as e:
+            warn_if_not(False, f"Couldn't compress {path}: {e}")
+    compressions.clear()
+    if compression_pool is not None:
+        compression_pool.shutdown()
+        compression_pool = None
+
+
+# Images
+#
+# With --optimize-images, the headshot and the paper icons get their width
+# and height in the pages, so nothing moves while they load. If Pillow is
+# installed, they also get WebP (and AVIF, where Pillow supports it) copies
+# at the sizes they're shown at, offered through <picture>. Copies are named
+# after a hash of the original, so an image is only encoded when it changes.
+IMAGE_CACHE = "images.json"
+ICONS = ["paper-img", "extra-img", "slides-img", "bibtex-img"]
+# widths to encode, and the sizes attribute, for each kind of image
+IMAGE_USES = {"headshot": ([235, 470], "min(33vw, 235px)"), "icon": ([20, 40], "20px")}
+
+Image = collections.namedtuple("Image", ["width", "height", "sources"])
+
+
+def image_sources(style: Dict[str, str], profile: Dict[str, str]):
+    sources = [(profile.get("headshot", ""), "headshot")]
+    sources += [(style.get(k + suffix, ""), "icon") for k in ICONS for suffix in ["", "-dark"]]
+    # only local images can be measured and encoded
+    return [(src, use) for src, use in sources if src != "" and not re.match(r"[a-z]+:|//", src)]
+
+
+def image_inputs(cache: Dict[str, str]):
+    # the images the pages will show, read before the data is validated
+    data = {}
+    for name in ["data/style.json", "data/profile.json"]:
+        try:
+            with open(os.path.join(config.prefix, name)) as f:
+                data[name] = json.load(f)
+        except Exception as _:
+            data[name] = {}
+
+    hashes = {}
+    for src, _ in image_sources(data["data/style.json"], data["data/profile.json"]):
+        i = f"{config.target}/{src}"
+        if i not in cache:
+            cache[i] = hash_file(os.path.join(config.prefix, i))
+        hashes[i] = cache[i]
+
+    return hashes
+
+
+def image_size(data: bytes):
+    # width and height from the header of a PNG, GIF, JPEG, or WebP file
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    if data[:6] in [b"GIF87a", b"GIF89a"]:
+        return int.from_bytes(data[6:8], "little"), int.from_bytes(data[8:10], "little")
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        if data[12:16] == b"VP8 ":
+            return int.from_bytes(data[26:28], "little") & 0x3FFF, int.from_bytes(data[28:30], "little") & 0x3FFF
+        if data[12:16] == b"VP8L":
+            bits = int.from_bytes(data[21:25], "little")
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if data[12:16] == b"VP8X":
+            return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    if data[:2] == b"\xff\xd8":
+        i = 2
+        while i + 9 < len(data) and data[i] == 0xFF:
+            marker = data[i + 1]
+            if marker in [0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF]:
+                return int.from_bytes(data[i + 7 : i + 9], "big"), int.from_bytes(data[i + 5 : i + 7], "big")
+            i += 2 + int.from_bytes(data[i + 2 : i + 4], "big")
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def image_formats():
+    # (mime type, extension, Pillow format) for each format we can write
+    try:
+        from PIL import features
+    except ImportError:
+        status("- Pillow isn't installed, so images only get their sizes", 0)
+        return []
+
+    formats = [("image/avif", "avif", "AVIF")] if features.check("avif") else []
+    return formats + ([("image/webp", "webp", "WEBP")] if features.check("webp") else [])
+
+
+def optimize_image(src: str, use: str, cache, written: List[str]):
+    path = os.path.join(config.prefix, config.target, src)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        status(f"- couldn't load {path}---leaving it as it is")
+        return None
+
+    digest = hashlib.sha256(data).hexdigest()
+    if digest not in cache:
+        cache[digest] = image_size(data)
+    if cache[digest] is None:
+        return None
+
+    width, height = cache[digest]
+    widths, sizes = IMAGE_USES[use]
+    widths = [w for w in widths if w < width] + [min(max(widths), width)]
+    base, _ = os.path.splitext(src)
+    sources = []
+    original = None
+    for mime, extension, format in image_formats():
+        srcset = []
+        for w in sorted(set(widths)):
+            name = f"{base}.{digest[:8]}.{w}.{extension}"
+            target = os.path.join(config.prefix, config.target, name)
+            if not os.path.exists(target):
+                from PIL import Image as PillowImage
+
+                status(f"- encoding {target}")
+                original = original or PillowImage.open(path)
+                original.resize((w, max(1, round(height * w / width))), PillowImage.LANCZOS).save(target, format)
+            written.append(name)
+            srcset.append(f"{name} {w}w")
+        sources.append((mime, ", ".join(srcset), sizes))
+
+    return Image(width, height, sources)
+
+
+def optimize_images(style: Dict[str, str], profile: Dict[str, str]):
+    cache_path = os.path.join(config.prefix, CACHE_DIR, IMAGE_CACHE)
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except Exception as _:
+        cache = {}
+
+    written = []
+    for src, use in image_sources(style, profile):
+        if src not in context.images:
+            image = optimize_image(src, use, cache, written)
+            if image is not None:
+                context.images[src] = image
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "w") as f:
+            json.dump(cache, f)
+    except Exception as _:
+        status(f"- couldn't write {cache_path}---continuing without it")
+
+    return written
+
+
+def image_html(src: str, cls: str, alt: str = ""):
+    alt = f' alt="{alt}"' if alt else ""
+    image = context.images.get(src)
+    if image is None:
+        return f'<img class="{cls}" src="{src}"{alt}/>'
+
+    img = f'<img class="{cls}" src="{src}"{alt} width="{image.width}" height="{image.height}"/>'
+    if len(image.sources) == 0:
+        return img
+    sources = "".join(f'<source type="{mime}" srcset="{srcset}" sizes="{sizes}">' for mime, srcset, sizes in image.sources)
+    return f"<picture>{sources}{img}</picture>"
+
+
+# Rendering
+#
+# Every output is rendered from the loaded site data by one of these. With
+# --jobs N they run in a pool of worker processes that get the data (and the
+# globals the builders use) once, when they start. Finished outputs are
+# written while the others are still rendering.
+OUTPUT_BUILDERS = {
+    "index.html": lambda d, _: build_index(
+        d["profile_json"], d["news_json"], d["pubs_index"], d["auto_links_json"], d["auto_notes_json"], d["has_dark"],
+        d["pages"]["news.html"], d["pages"]["pubs.html"],
+    ),
+    "news.html": lambda d, name: build_news_page(
+        d["shards"][name].items, d["auto_links_json"], d["auto_notes_json"], d["has_dark"], d["pages"]["news.html"], name,
+        d["search"],
+    ),
+    "pubs.html": lambda d, name: build_pubs_page(
+        d["shards"][name].items, d["auto_links_json"], d["auto_notes_json"], d["has_dark"], d["pages"]["pubs.html"], name,
+        d["search"],
+    ),
+    "main.css": lambda d, _: d["main_css"],
+    "light.css": lambda d, _: d["light_css"],
+    "dark.css": lambda d, _: d["dark_css"],
+    "reset.css": lambda d, _: d["assets"]["reset.css"],
+    "scroller.js": lambda d, _: d["assets"]["scroller.js"],
+    "mode.js": lambda d, _: d["assets"]["mode.js"],
+    "search.js": lambda d, _: d["assets"]["search.js"],
+    "search.json": lambda d, _: build_search(d["pages"]),
+    "cv/cv.tex": lambda d, _: build_cv(
+        d["meta_json"], d["profile_json"], d["education_json"], d["pubs_index"], d["presentations_json"],
+        d["teaching_json"], d["work_json"], d["service_json"], d["awards_json"], d["volunteer_json"], d["languages_json"],
+    ),
+    "cv/cv.bib": lambda d, _: build_cv_bib(d["pubs_bibtex"], d["meta_json"]["name"]),
+}
+
+
+def init_worker(site_context: SiteContext, site):
+    global worker_site
+
+    use_site_context(site_context)
+    worker_site = site
+
+
+def render_in_worker(builder: str, name: str):
+    contents = OUTPUT_BUILDERS[builder](worker_site, name)
+    return contents if isinstance(contents, str) else "".join(contents)
+
+
+def render_outputs(outputs: List[str], site, jobs: int):
+    # outputs are (builder, file name) pairs
+    if jobs <= 1 or len(outputs) <= 1:
+        for builder, name in outputs:
+            yield name, OUTPUT_BUILDERS[builder](site, name)
+        return
+
+    import concurrent.futures
+
+    with concurrent.futures.ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(context, site)) as pool:
+        futures = {pool.submit(render_in_worker, builder, name): name for builder, name in outputs}
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], future.result()
+
+
+# Development server
+#
+# --serve builds once, serves the output directory, and rebuilds whatever is
+# stale whenever something in data/ or the templates changes. Publications
+# stay in memory between rebuilds. Open pages get a tiny script that listens
+# on /__reload (server-sent events) and reloads when a rebuild wrote files.
+RELOAD_PATH = "/__reload"
+RELOAD_SCRIPT = '<script>new EventSource("%s").onmessage = function() { location.reload(); };</script>\n' % RELOAD_PATH
+# seconds between keep-alive comments on /__reload
+RELOAD_PING = 15
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+
+reload_condition = threading.Condition()
+reload_generation = 0
+
+
+# mixed into http.server.SimpleHTTPRequestHandler by serve()
+class LiveReload:
+    def do_GET(self):
+        if self.path == RELOAD_PATH:
+            return self.send_reload()
+
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, "index.html")
+        if not path.endswith(".html") or not os.path.exists(path):
+            return super().do_GET()
+
+        with open(path, "rb") as f:
+            page = f.read().replace(b"</body>", RELOAD_SCRIPT.encode() + b"</body>", 1)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(page)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(page)
+
+    def send_reload(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+
+        with reload_condition:
+            seen = reload_generation
+        try:
+            while True:
+                with reload_condition:
+                    reloaded = reload_condition.wait_for(lambda: reload_generation != seen, timeout=RELOAD_PING)
+                if reloaded:
+                    self.wfile.write(b"data: reload\n\n")
+                    self.wfile.flush()
+                    return
+                # a comment keeps proxies from dropping the connection, and
+                # fails once the tab is closed, which frees this thread
+                self.wfile.write(b": ping\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError) as _:
+            pass
+
+    def log_message(self, format, *args):
+        status("- " + format % args, 2)
+
+
+def notify_reload():
+    global reload_generation
+
+    with reload_condition:
+        reload_generation += 1
+        reload_condition.notify_all()
+
+
+def watch_inotify(dirs: List[str]):
+    import ctypes
+    import ctypes.util
+
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    fd = libc.inotify_init()
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init failed")
+
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    for d in dirs:
+        if libc.inotify_add_watch(fd, d.encode(), mask) < 0:
+            raise OSError(ctypes.get_errno(), f"can't watch {d}")
+
+    # set up above, not in the generator, so serve() can fall back to polling
+    def changes():
+        while True:
+            os.read(fd, 65536)
+            # editors often save in several steps, so wait for the burst to end
+            while select.select([fd], [], [], 0.02)[0]:
+                os.read(fd, 65536)
+            yield
+
+    return changes()
+
+
+def watch_polling(dirs: List[str], interval: float = 0.2):
+    def snapshot():
+        stats = {}
+        for d in [d for d in dirs if os.path.isdir(d)]:
+            for name in os.listdir(d):
+                try:
+                    st = os.stat(os.path.join(d, name))
+                    stats[os.path.join(d, name)] = (st.st_mtime_ns, st.st_size)
+                except Exception as _:
+                    pass
+        return stats
+
+    last = snapshot()
+    while True:
+        time.sleep(interval)
+        current = snapshot()
+        if current != last:
+            last = current
+            yield
+
+
+def serve(args):
+    import http.server
+
+    rebuild(args, args.incremental)
+
+    LiveReloadHandler = type("LiveReloadHandler", (LiveReload, http.server.SimpleHTTPRequestHandler), {})
+    handler = functools.partial(LiveReloadHandler, directory=os.path.join(config.prefix, config.target))
+    server = http.server.ThreadingHTTPServer(("localhost", args.port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    success(f"Serving {config.target} at http://localhost:{server.server_port}/ (Ctrl-C to stop)")
+
+    dirs = [os.path.join(config.prefix, "data"), os.path.join(config.prefix, config.templates)]
+    try:
+        changes = watch_inotify(dirs)
+        status(f"Watching {', '.join(dirs)} with inotify")
+    except Exception as _:
+        changes = watch_polling(dirs)
+        status(f"Watching {', '.join(dirs)} by polling")
+
+    try:
+        for _ in changes:
+            start = time.perf_counter()
+            if rebuild(args, True):
+                status(f"Rebuilt in {(time.perf_counter() - start) * 1000:.0f} ms", 0)
+                notify_reload()
+    except KeyboardInterrupt:
+        server.shutdown()
+        exit(0)
+
+
+def rebuild(args, incremental: bool):
+    # error() exits, but a typo in a data file shouldn't stop the server
+    try:
+        return build(args, incremental)
+    except SystemExit as _:
+        return []
+
+
+# Batch builds
+#
+# --batch sites.json builds many websites in one process (or, with --jobs N,
+# in N worker processes), so pybtex is imported once and compiled templates,
+# minified stylesheets, and publications are shared by the sites a process
+# builds. sites.json is a list of {"prefix", "output", "templates"}, with
+# prefixes relative to sites.json and the rest relative to their prefix. The
+# other options apply to every site.
+BATCH_SCHEMA = Schema("site", False, [("prefix", REQUIRED), ("output", "docs"), ("templates", "templates")], [])
+
+
+def read_batch(path: str):
+    try:
+        with open(path) as f:
+            sites = json.load(f)
+    except Exception as _:
+        error(f"Failed to parse {path}. Check your commas, braces, and if the file exists.")
+
+    fail_if_any(check_data(sites, BATCH_SCHEMA, path))
+    for site in sites:
+        site["prefix"] = os.path.join(os.path.dirname(path), site["prefix"])
+    return sites
+
+
+def build_in_batch(site, args):
+    # returns the prefix, the seconds the build took, whether it worked, and what it printed
+    import io
+
+    use_site_context(SiteContext(Config(verbosity=args.verbosity, prefix=site["prefix"], target=site["output"], templates=site["templates"])))
+    log = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(log):
+            build(args, args.incremental)
+        ok = True
+    except SystemExit as e:
+        ok = e.code in [0, None]
+    return site["prefix"], time.perf_counter() - start, ok, log.getvalue()
+
+
+def build_sites(sites, args):
+    # the sites are built in parallel, so each one renders its pages serially
+    site_args = argparse.Namespace(**dict(vars(args), jobs=1))
+    if args.jobs <= 1:
+        for site in sites:
+            yield build_in_batch(site, site_args)
+        return
+
+    import concurrent.futures
+
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+        futures = [pool.submit(build_in_batch, site, site_args) for site in sites]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+
+def batch(args):
+    timings = []
+    start = time.perf_counter()
+    for prefix, seconds, ok, log in build_sites(read_batch(args.batch), args):
+        status(f"Built {prefix}:", 0)
+        print(log, end="")
+        timings.append((seconds, prefix, ok))
+    total = time.perf_counter() - start
+
+    print(f"\n{'site':<40} {'time':>10}")
+    for seconds, prefix, ok in sorted(timings, reverse=True):
+        print(f"{prefix:<40} {seconds * 1000:>8.0f}ms{'' if ok else '  FAILED'}")
+    print(f"{'all ' + str(len(timings)) + ' sites':<40} {total * 1000:>8.0f}ms")
+
+    failed = [prefix for _, prefix, ok in timings if not ok]
+    fail_if_not(len(failed) == 0, f"Couldn't build {', '.join(failed)}")
+    success(f"Built {len(timings)} websites!")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+                prog="./build.py",
+                description="Federico's Academic Website Generator: Builds a website from json files.",
+                epilog="For more information, see README.md.")
+
+    parser.add_argument('-v', '--verbosity', type=int, default=0, help=f"set the output verbosity (default: 0)")
+    parser.add_argument('-o', '--output', type=str, default="docs", help=f"set the output directory (default: \"docs\")")
+    parser.add_argument('-t', '--templates', type=str, default="templates", help=f"set the templates directory (default: \"templates\")")
+    parser.add_argument('-c', "--curriculum-vitae", action="store_true", help="generate a curriculum vitae in LaTeX too")
+    parser.add_argument("--cv-pdf", action="store_true", help="with -c, also compile cv/cv.pdf, running only the xelatex and biber passes that are needed")
+    parser.add_argument('-i', "--incremental", action="store_true", help="only rebuild the files whose inputs changed since the last build")
+    parser.add_argument('-f', "--fingerprint", action="store_true", help="minify the stylesheets and scripts and put a hash of their contents in their names")
+    parser.add_argument("--inline-css", action="store_true", help="put the stylesheets in the pages, defer scripts, and switch themes with CSS variables")
+    parser.add_argument("--optimize-images", action="store_true", help="give images their sizes in the pages and, with Pillow, smaller WebP and AVIF copies")
+    parser.add_argument("--search", action="store_true", help="add a search box to the news and publications pages, with an index in search.json")
+    parser.add_argument('-z', "--compress", action="store_true", help="also write .gz (and, with brotli, .br) copies of the pages, stylesheets, scripts, bibliography, and search index")
+    parser.add_argument('-j', "--jobs", type=int, default=1, help="render pages in this many processes (default: 1)")
+    parser.add_argument("--batch", type=str, default=None, metavar="SITES", help="build every website listed in this JSON file, sharing one process per job (ignores -o and -t)")
+    parser.add_argument('-s', "--serve", action="store_true", help="serve the website, rebuild it when data or templates change, and reload the browser")
+    parser.add_argument('-p', "--port", type=int, default=8000, help="set the port for --serve (default: 8000)")
+    parser.add_argument("--origin", type=str, default=None, help="use this git remote URL instead of reading it from .git/config (or set $WEBSITE_ORIGIN)")
+    parser.add_argument("--profile", type=str, nargs="?", const="", metavar="TRACE", help="time each phase of the build and, if given a file name, write a Chrome trace there")
+    parser.add_argument("--profile-memory", action="store_true", help="with --profile, also record what each phase allocates (slower)")
+
+    args = parser.parse_args()
+
+    config = Config(
+        verbosity=args.verbosity,
+        prefix=os.path.dirname(__file__),
+        target=args.output,
+        templates=args.templates,
+    )
+
+    if args.origin is not None:
+        origin_override = args.origin
+
+    if args.batch is not None:
+        batch(args)
+        exit(0)
+
+    if args.serve:
+        serve(args)
+
+    if args.profile is not None:
+        profiling = True
+        if args.profile_memory:
+            import tracemalloc
+            tracemalloc.start()
+
+    build(args, args.incremental)
+    if profiling:
+        report_profile(args.profile)
     exit(0)
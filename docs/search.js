@@ -0,0 +1,76 @@
+// Searches the publications and news in search.json, which build.py writes
+// with --search. The index is only downloaded the first time it is needed.
+var searchInput = document.getElementById("search");
+var searchResults = document.getElementById("search-results");
+var searchIndex = null;
+
+function searchWords(text) {
+  var plain = text.normalize("NFKD").replace(/[\u0300-\u036f]/g, "").toLowerCase();
+  return plain.match(/[a-z0-9]+/g) || [];
+}
+
+function loadSearchIndex() {
+  if (searchIndex === null) {
+    searchIndex = fetch(searchInput.dataset.index).then(function(response) {
+      return response.json();
+    }).then(function(index) {
+      // each list of records is stored as the gaps between record numbers
+      for (var word in index.terms) {
+        var postings = index.terms[word];
+        for (var i = 1; i < postings.length; i++) {
+          postings[i] += postings[i - 1];
+        }
+      }
+      index.words = Object.keys(index.terms).sort();
+      return index;
+    });
+  }
+  return searchIndex;
+}
+
+// records with any word that starts with prefix
+function searchPrefix(index, prefix) {
+  var found = new Set();
+  var lo = 0, hi = index.words.length;
+  while (lo < hi) {
+    var mid = (lo + hi) >> 1;
+    if (index.words[mid] < prefix) { lo = mid + 1; } else { hi = mid; }
+  }
+  for (var i = lo; i < index.words.length && index.words[i].startsWith(prefix); i++) {
+    index.terms[index.words[i]].forEach(function(doc) { found.add(doc); });
+  }
+  return found;
+}
+
+function search(index, query) {
+  var matches = null;
+  searchWords(query).forEach(function(word) {
+    var found = searchPrefix(index, word);
+    matches = matches === null ? found : new Set(Array.from(matches).filter(function(doc) { return found.has(doc); }));
+  });
+  return matches === null ? [] : Array.from(matches).sort(function(a, b) { return a - b; });
+}
+
+function showResults(index, docs) {
+  searchResults.replaceChildren();
+  docs.slice(0, 20).forEach(function(doc) {
+    var item = document.createElement("li");
+    var link = document.createElement("a");
+    var detail = document.createElement("small");
+    link.href = index.docs[doc][0];
+    link.textContent = index.docs[doc][1];
+    detail.textContent = index.docs[doc][2];
+    item.append(link, document.createElement("br"), detail);
+    searchResults.append(item);
+  });
+}
+
+searchInput.addEventListener("focus", loadSearchIndex);
+searchInput.addEventListener("input", function() {
+  var query = searchInput.value;
+  loadSearchIndex().then(function(index) {
+    if (searchInput.value === query) {
+      showResults(index, search(index, query));
+    }
+  });
+});